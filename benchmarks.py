@@ -0,0 +1,777 @@
+"""效能基準測試 (離線執行，不需 Firebase / Gemini)
+
+用法：
+    python benchmarks.py suite [--save-baseline | --check] [--baseline bench_baseline.json]
+    python benchmarks.py srs [--sizes 10000 100000 1000000]
+    python benchmarks.py gemini-client [--keys 10] [--calls 200]
+    python benchmarks.py auth [--logins 50] [--connect-ms 30] [--rtt-ms 10]
+
+suite 以本地替身 (FakeFirestore / FakeGenerativeModel / 假 gTTS，可設定注入延遲) 量測：
+SRS 抽詞與排程、start_session -> next_card -> process_review 的卡片切換延遲，以及大型單字檔載入。
+結果可存成 baseline，之後以 --check 比對，超過容許比例或 baseline 缺少指標即回傳非 0 (微基準取多輪中位數；legacy_* 為舊做法的對照組，不列入檢查)。
+有指標退步時會在新的 process 重跑一次，兩次都退步才算失敗，單次的排程雜訊不會讓 --check 失敗。
+"""
+import argparse
+import copy
+import http.server
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from google.cloud.firestore_v1 import transforms
+from streamlit.runtime.secrets import Secrets
+
+import online_vocab_app as vocab_app
+from online_vocab_app import (
+    Config, GeminiClientRegistry, SRSEngine, ReviewIndex, DailyQueue, AuthSessionStore, FirebaseService,
+    WordListIndex
+)
+
+DEFAULT_BASELINE = "bench_baseline.json"
+SUITE_ROUNDS = 9                  # suite 的微基準每項跑幾輪取中位數
+CONTROL_METRICS = ("legacy_",)    # 舊做法的對照組：只列出供比較，不列入退步檢查
+ABSOLUTE_FLOOR_MS = 0.1           # 比 baseline 慢不到這麼多 (毫秒) 不算退步：微秒級指標的比例雜訊很大
+
+
+# =================================================================
+# 本地替身 (Local stand-ins)
+# =================================================================
+class Latency:
+    """注入的延遲 (秒)"""
+
+    def __init__(self, firestore=0.0, gemini=0.0, tts=0.0):
+        self.firestore = firestore
+        self.gemini = gemini
+        self.tts = tts
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+def _apply_merge(dst, src):
+    """模擬 set(merge=True) 的深層合併與 DELETE_FIELD / ArrayUnion / Increment"""
+    for key, value in src.items():
+        if value is transforms.DELETE_FIELD:
+            dst.pop(key, None)
+        elif isinstance(value, transforms.ArrayUnion):
+            current = dst.setdefault(key, [])
+            current.extend(v for v in value.values if v not in current)
+        elif isinstance(value, transforms.Increment):
+            dst[key] = dst.get(key, 0) + value.value
+        elif isinstance(value, dict):
+            if not isinstance(dst.get(key), dict):
+                dst[key] = {}
+            _apply_merge(dst[key], value)
+        else:
+            dst[key] = copy.deepcopy(value)
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None):
+        self._db.wait()
+        with self._db.lock:
+            data = self._db.docs.get(self.path)
+            if data is not None and field_paths is not None:
+                data = {k: v for k, v in data.items() if k in field_paths}
+            return FakeSnapshot(self.id, copy.deepcopy(data))
+
+    def _write(self, data, merge):
+        with self._db.lock:
+            if merge:
+                _apply_merge(self._db.docs.setdefault(self.path, {}), data)
+            else:
+                self._db.docs[self.path] = {}
+                _apply_merge(self._db.docs[self.path], data)
+            self._db.writes += 1
+
+    def set(self, data, merge=False):
+        self._db.wait()
+        self._write(data, merge)
+
+    def update(self, data):
+        self._db.wait()
+        with self._db.lock:
+            if self.path not in self._db.docs:
+                raise KeyError(f"No document to update: {self.path}")
+        self._write(data, True)
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=()):
+        self._db = db
+        self._path = path
+        self._filters = filters
+
+    def where(self, filter):
+        return FakeQuery(self._db, self._path, self._filters + (filter,))
+
+    def stream(self):
+        self._db.wait()
+        ops = {"<": lambda a, b: a < b, "<=": lambda a, b: a <= b, "==": lambda a, b: a == b,
+               ">=": lambda a, b: a >= b, ">": lambda a, b: a > b}
+        with self._db.lock:
+            items = [(p, copy.deepcopy(d)) for p, d in self._db.docs.items() if p.rsplit("/", 1)[0] == self._path]
+        for path, data in items:
+            if all(f.field_path in data and ops[f.op_string](data[f.field_path], f.value) for f in self._filters):
+                yield FakeSnapshot(path.rsplit("/", 1)[1], data)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, name):
+        return FakeDocument(self._db, f"{self._path}/{name}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append((ref, data, merge))
+
+    def commit(self):
+        self._db.wait()  # 一次批次 = 一次來回
+        for ref, data, merge in self._ops:
+            ref._write(data, merge)
+
+
+class FakeFirestore:
+    """記憶體中的 Firestore 替身，涵蓋 App 用到的 API；每次來回加上 latency 秒"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.docs = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Gemini 替身：字典請求回傳 JSON，其他 prompt 回傳固定文字 (可串流)"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            word = prompt.split('"')[1] if '"' in prompt else "word"
+            return FakeResponse(json.dumps({"phonetic": f"/{word}/", "definition": f"{word} 的定義",
+                                            "example": f"An example with {word}."}))
+        text = "Once upon a time, a **word** appeared.\n\n從前從前，出現了一個**單字**。"
+        if stream:
+            return iter([FakeResponse(text[i:i + 16]) for i in range(0, len(text), 16)])
+        return FakeResponse(text)
+
+
+class FakeGeminiRegistry:
+    def __init__(self, model):
+        self._model = model
+
+    @contextmanager
+    def lease(self, api_key, model_name=None):
+        yield self._model
+
+
+class FakeAuthEmulator:
+    """Firebase Auth Emulator 的本地替身 (相同 URL 格式：signUp / signInWithPassword / token)
+
+    每條新連線先等待 connect_latency 秒模擬 TCP + TLS 交握，每個請求再等待 rtt 秒；
+    以 FIREBASE_AUTH_EMULATOR_HOST=<host> 讓 FirebaseService 改連這裡。
+    """
+
+    def __init__(self, connect_latency=0.0, rtt=0.0):
+        self.connect_latency = connect_latency
+        self.rtt = rtt
+        self.connections = 0
+        self.requests = 0
+        self._users = {}    # email -> (uid, password)
+        self._refresh = {}  # refresh token -> uid
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _issue(self, uid):
+        refresh = uuid.uuid4().hex
+        with self._lock:
+            self._refresh[refresh] = uid
+        return f"id-{uuid.uuid4().hex}", refresh
+
+    def handle(self, path, body):
+        """回傳 (status, payload)"""
+        if path.startswith("/identitytoolkit.googleapis.com/v1/accounts:"):
+            action = path.split("accounts:", 1)[1].split("?", 1)[0]
+            req = json.loads(body or b"{}")
+            email, password = req.get("email"), req.get("password")
+            with self._lock:
+                user = self._users.get(email)
+                if action == "signUp":
+                    if user is not None:
+                        return 400, {"error": {"message": "EMAIL_EXISTS"}}
+                    user = self._users[email] = ("uid-" + email.split("@")[0], password)
+            if action == "signInWithPassword" and (user is None or user[1] != password):
+                return 400, {"error": {"message": "INVALID_LOGIN_CREDENTIALS"}}
+            id_token, refresh = self._issue(user[0])
+            return 200, {"localId": user[0], "email": email, "idToken": id_token,
+                         "refreshToken": refresh, "expiresIn": "3600"}
+        if path.startswith("/securetoken.googleapis.com/v1/token"):
+            form = urllib.parse.parse_qs(body.decode("utf-8"))
+            with self._lock:
+                uid = self._refresh.get(form.get("refresh_token", [""])[0])
+            if uid is None:
+                return 400, {"error": {"message": "INVALID_REFRESH_TOKEN"}}
+            id_token, refresh = self._issue(uid)
+            return 200, {"user_id": uid, "id_token": id_token, "refresh_token": refresh, "expires_in": "3600"}
+        return 404, {"error": {"message": "NOT_FOUND"}}
+
+    def start(self):
+        """在背景執行緒啟動，回傳 host:port"""
+        emulator = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # 標頭與內容分開送出時避免 delayed ACK 的 40ms 延遲
+
+            def setup(self):
+                super().setup()
+                with emulator._lock:
+                    emulator.connections += 1
+                time.sleep(emulator.connect_latency)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with emulator._lock:
+                    emulator.requests += 1
+                time.sleep(emulator.rtt)
+                status, payload = emulator.handle(self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def install_secrets():
+    # 全域 secrets 只設定一次：AppTest.secrets 每次 run 都會替換全域的 st.secrets，多執行緒並行時會互相干擾
+    secrets = Secrets()
+    secrets._secrets = {"firebase": {"api_key": "fake-firebase-key"}}
+    vocab_app.st.secrets = secrets
+
+
+def install_fakes(latency, workdir, users=()):
+    """把 App 的外部相依替換成本地替身，回傳 (db, model)；users 為 [(uid, email)]"""
+    db = FakeFirestore(latency.firestore)
+    model = FakeGenerativeModel(latency.gemini)
+    registry = FakeGeminiRegistry(model)
+
+    def fake_synthesize(text, lang="en"):
+        time.sleep(latency.tts)
+        return b"ID3" + text.encode("utf-8")
+
+    def fake_auth(self, email, password, is_login=True):
+        time.sleep(latency.firestore)
+        uid = "uid-" + email.split("@")[0]
+        return {"localId": uid, "email": email, "idToken": "fake-token", "refreshToken": "fake-refresh",
+                "expiresIn": "3600"}
+
+    for uid, email in users:
+        db.collection("users").document(uid).set({"api_key": "fake-gemini-key"})
+
+    install_secrets()
+    vocab_app.get_firebase_db = lambda: db
+    vocab_app.get_gemini_registry = lambda: registry
+    vocab_app.AudioCache.synthesize = staticmethod(fake_synthesize)
+    vocab_app.FirebaseService.auth_user = fake_auth
+    Config.DICT_CACHE_FILE = os.path.join(workdir, "dict_cache.sqlite3")
+    Config.AUDIO_CACHE_DIR = os.path.join(workdir, "audio")
+    Config.DICT_PACK_FILE = os.path.join(workdir, "dictionary.pack")
+    Config.JOURNAL_DIR = os.path.join(workdir, "journal")
+    Config.WARM_UP_IMPORTS = False  # 替身已取代這些套件，背景載入只會干擾量測
+    Config.GEMINI_RATE_PER_KEY = 1e9
+    Config.GEMINI_BURST_PER_KEY = 1e9
+    return db, model
+
+
+def write_word_file(path, size):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"value": {"word": f"word{i}"}} for i in range(size)], f)
+
+
+def make_history(words, seen_ratio=0.2, due_ratio=0.5, seed=42):
+    """依比例產生學習紀錄：seen_ratio 的單字學過，其中 due_ratio 已到期"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    history = {}
+    for word in rng.sample(words, int(len(words) * seen_ratio)):
+        days = -rng.randint(1, 30) if rng.random() < due_ratio else rng.randint(1, 30)
+        history[word] = {"mastery": rng.randint(0, 5), "seen": rng.randint(1, 10),
+                         "interval": abs(days), "next_review": (now + timedelta(days=days)).isoformat()}
+    return history
+
+
+def legacy_review_batch(history, full_list, batch_size=5):
+    """原本的全量掃描版本，作為對照組"""
+    now = datetime.now().isoformat()
+    review_list = [w for w, d in history.items() if d.get("next_review", "") < now]
+    new_list = [w for w in full_list if w not in history]
+    selected = []
+    if review_list:
+        selected.extend(random.sample(review_list, min(len(review_list), 3)))
+    needed = batch_size - len(selected)
+    if needed > 0 and new_list:
+        selected.extend(random.sample(new_list, min(len(new_list), needed)))
+    random.shuffle(selected)
+    return selected
+
+
+def timeit(fn, repeat, rounds=1, setup=None):
+    """回傳每次呼叫的秒數：跑 rounds 輪、每輪呼叫 repeat 次，取各輪平均的中位數 (單一輪的雜訊不影響結果)
+
+    setup 在每輪開始前執行，不計入時間。
+    """
+    samples = []
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        samples.append((time.perf_counter() - start) / repeat)
+    return statistics.median(samples)
+
+
+def bench_srs(sizes, repeat=20):
+    results = []
+    for size in sizes:
+        words = [f"word{i}" for i in range(size)]
+        history = make_history(words)
+
+        legacy = timeit(lambda: legacy_review_batch(history, words), max(1, repeat // 10))
+        build_start = time.perf_counter()
+        index = ReviewIndex(history, words)
+        build = time.perf_counter() - build_start
+        indexed = timeit(lambda: SRSEngine.get_review_batch(history, words, index=index), repeat)
+
+        def review_one():
+            word = random.choice(words)
+            SRSEngine.calculate_next_review(history.get(word, {}), 4, word=word, index=index)
+        update = timeit(review_one, repeat)
+
+        results.append({
+            "words": size,
+            "history": len(history),
+            "legacy_batch_ms": round(legacy * 1000, 3),
+            "index_build_ms": round(build * 1000, 3),
+            "indexed_batch_ms": round(indexed * 1000, 4),
+            "indexed_update_ms": round(update * 1000, 4),
+            "speedup": round(legacy / indexed, 1) if indexed else None
+        })
+        print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+
+def bench_gemini_client(keys=10, calls=200):
+    """每次呼叫的準備成本：configure + 新 model + 新 client (舊做法) vs registry 重用 (不含網路)"""
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+
+    api_keys = [f"fake-key-{i}" for i in range(keys)]
+
+    def legacy():
+        for i in range(calls):
+            genai.configure(api_key=api_keys[i % keys])
+            model = genai.GenerativeModel(Config.MODEL_NAME)
+            model._client = genai_client.get_default_generative_client()  # generate_content 第一次呼叫時做的事
+
+    registry = GeminiClientRegistry(max_clients=keys, idle_ttl=3600)
+
+    def pooled():
+        for i in range(calls):
+            with registry.lease(api_keys[i % keys]):
+                pass
+
+    legacy_sec = timeit(legacy, 1) / calls
+    pooled()  # 先建立每把 Key 的 client，量測的是穩定狀態
+    pooled_sec = timeit(pooled, 1) / calls
+    result = {
+        "keys": keys,
+        "calls": calls,
+        "legacy_per_call_ms": round(legacy_sec * 1000, 4),
+        "registry_per_call_ms": round(pooled_sec * 1000, 4),
+        "clients_created": registry.created,
+        "speedup": round(legacy_sec / pooled_sec, 1) if pooled_sec else None
+    }
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def bench_auth(logins=50, connect_latency=0.03, rtt=0.01):
+    """登入：每次新連線 (舊做法) vs 共用連線池；重新整理頁面：重新登入 vs 還原 session (快取 / refresh)"""
+    import requests
+
+    emulator = FakeAuthEmulator(connect_latency, rtt)
+    host = emulator.start()
+    previous = os.environ.get("FIREBASE_AUTH_EMULATOR_HOST")
+    os.environ["FIREBASE_AUTH_EMULATOR_HOST"] = host
+    try:
+        install_secrets()
+        service = FirebaseService(db=FakeFirestore())
+        service.auth_user("bench@example.com", "secret", is_login=False)
+        base, _ = service._auth_endpoints()
+        url = f"{base}/accounts:signInWithPassword?key={service.api_key}"
+        payload = {"email": "bench@example.com", "password": "secret", "returnSecureToken": True}
+
+        def one_off():
+            requests.post(url, json=payload, timeout=10).json()
+
+        def pooled():
+            service.auth_user("bench@example.com", "secret")
+
+        store = AuthSessionStore(max_sessions=100, ttl=3600)
+        sids = {"cached": store.create(service.auth_user("bench@example.com", "secret")),
+                "expired": store.create(service.auth_user("bench@example.com", "secret"))}
+
+        def restore(name):
+            restored = store.restore(sids[name], service.refresh_token)
+            assert restored is not None
+            sids[name] = restored[0]  # sid 單次使用，下一輪用換發的新 sid
+
+        def restore_refresh():
+            store._sessions[sids["expired"]]["expires_at"] = 0  # 強制走 refresh
+            restore("expired")
+
+        timings = {}
+        for name, fn in [("one_off_sign_in", one_off), ("pooled_sign_in", pooled),
+                         ("restore_refresh", restore_refresh),
+                         ("restore_cached", lambda: restore("cached"))]:
+            samples = []
+            for _ in range(logins):
+                start = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - start)
+            timings[name] = round(percentile(samples, 0.5) * 1000, 3)
+    finally:
+        emulator.stop()
+        if previous is None:
+            os.environ.pop("FIREBASE_AUTH_EMULATOR_HOST", None)
+        else:
+            os.environ["FIREBASE_AUTH_EMULATOR_HOST"] = previous
+
+    result = {"logins": logins, "connect_ms": connect_latency * 1000, "rtt_ms": rtt * 1000,
+              "p50_ms": timings, "connections_opened": emulator.connections, "requests": emulator.requests}
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+# =================================================================
+# 基準測試項目
+# =================================================================
+def bench_schedule(sizes, repeat=200):
+    """get_review_batch (索引)、每日佇列切出一批與 calculate_next_review 在不同歷史量下的每次耗時"""
+    metrics = {}
+    for size in sizes:
+        words = [f"word{i}" for i in range(size * 5)]
+        history = make_history(words, seen_ratio=0.2)
+        index = ReviewIndex(history, words)
+        metrics[f"get_review_batch_ms@{size}"] = timeit(
+            lambda: SRSEngine.get_review_batch(history, words, index=index), repeat, SUITE_ROUNDS) * 1000
+        queue = DailyQueue.build(index)
+        metrics[f"daily_queue_peek_ms@{size}"] = timeit(lambda: queue.peek(index), repeat, SUITE_ROUNDS) * 1000
+        targets = random.Random(1).sample(list(history), min(repeat, len(history)))
+        it = itertools.cycle(targets)
+
+        def review_one():
+            word = next(it)
+            history[word] = SRSEngine.calculate_next_review(history[word], 4, word=word, index=index)
+        metrics[f"calculate_next_review_us@{size}"] = timeit(review_one, len(targets), SUITE_ROUNDS) * 1e6
+    return metrics
+
+
+def _vocab_app_script():
+    # AppTest 會把此函式原始碼當成腳本執行；import 拿到的是已安裝替身的同一個模組
+    import online_vocab_app
+    online_vocab_app.main()
+
+
+def _click(at, label):
+    for button in at.button:
+        if button.label.startswith(label):
+            button.click()
+            return at.run()
+    raise LookupError(f"找不到按鈕 {label}")
+
+
+def run_learner(email, sessions=1, story=False, timeout=60, think=0.0):
+    """以 AppTest 模擬一位學習者：登入 -> 抽詞 -> 逐張評分 (-> 生成故事)，回傳 {互動: [秒...]}
+
+    think 為每輪結束後、開始下一輪前停留的秒數 (不計時)，模擬使用者看完故事頁再繼續。
+    """
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+        if result.exception:
+            raise RuntimeError(f"{name}: {result.exception[0].value}")
+        return result
+
+    at = AppTest.from_function(_vocab_app_script, default_timeout=timeout)
+    timed("first_paint", at.run)
+    at.text_input(key="login_email").input(email)
+    at.text_input(key="login_pass").input("password")
+    timed("login", lambda: _click(at, "登入"))
+    for i in range(sessions):
+        if i:
+            time.sleep(think)
+        timed("start_session", lambda: _click(at, "🚀"))
+        if at.session_state.stage != "learning":
+            break  # 今日佇列已取完 (超過 DAILY_NEW_LIMIT)，沒有卡片可學
+        while at.session_state.stage == "learning":
+            timed("show_answer", lambda: _click(at, "👁️"))
+            timed("card_to_card", lambda: _click(at, random.choice(["😓", "😊", "⚡", "❌"])))
+        if story:
+            # 同一組單字的故事已在快取中時直接顯示 (沒有按鈕)，改量測一次重繪
+            if any(button.label.startswith("🪄") for button in at.button):
+                timed("story", lambda: _click(at, "🪄"))
+            else:
+                timed("story", at.run)
+        timed("back_home", lambda: _click(at, "🏠"))
+    # 等背景同步寫完，避免呼叫端清掉暫存目錄時仍在寫入本地日誌
+    buffer = at.session_state["sync_buffer"]
+    if buffer is not None:
+        if buffer._bg_thread is not None:
+            buffer._bg_thread.join()
+        buffer.flush()  # 計時器觸發時已無變動，不會再寫入
+    return timings
+
+
+def bench_card_flow(latency, cards_sessions=3, think=0.5):
+    """start_session -> next_card -> process_review 的端到端延遲 (AppTest + 本地替身)
+
+    每輪之間停留 think 秒：程式連點比背景預熱快，不停留時 start_session 量到的是兩者的競速 (雜訊很大)；
+    停留後量到的是下一批已預熱時的延遲，預熱失效 (例如下一批沒有命中) 時仍會明顯變慢。
+    回傳 (指標, 字典快取的命中統計)；命中率不是越小越好，不放進 metrics。
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        word_file = os.path.join(workdir, "full-word.json")
+        write_word_file(word_file, 5000)
+        Config.FULL_WORD_FILE = word_file
+        # 與 load_test 相同：每日新字上限要足夠跑完指定的輪數，否則後面幾輪只量到「今天已學完」
+        Config.DAILY_NEW_LIMIT = max(Config.DAILY_NEW_LIMIT, cards_sessions * Config.SESSION_SIZE)
+        install_fakes(latency, workdir, users=[("uid-bench", "bench@example.com")])
+        timings = run_learner("bench@example.com", sessions=cards_sessions, think=think)
+        cache_stats = vocab_app.get_dictionary_cache().stats()
+    metrics = {f"{name}_p50_ms": percentile(values, 0.5) * 1000 for name, values in timings.items()} | \
+              {"card_to_card_p95_ms": percentile(timings["card_to_card"], 0.95) * 1000}
+    return metrics, cache_stats
+
+
+def bench_word_list(sizes):
+    """單字檔載入：舊版 json.load、串流解析 (冷啟動)、讀取 .idx 索引 (熱啟動)"""
+    metrics = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            path = os.path.join(workdir, f"words-{size}.json")
+            write_word_file(path, size)
+
+            def legacy():
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return [item.get("value", {}).get("word") or item.get("word") for item in data]
+
+            def load():
+                vocab_app._load_word_list.clear()
+                return vocab_app.load_static_word_list(path)
+
+            def drop_index():
+                if os.path.exists(WordListIndex.path_for(path)):
+                    os.remove(WordListIndex.path_for(path))
+
+            metrics[f"legacy_json_load_ms@{size}"] = timeit(legacy, 1, SUITE_ROUNDS) * 1000
+            # 每輪先刪掉 .idx，量的是冷啟動 (串流解析並建立 .idx)
+            metrics[f"stream_parse_ms@{size}"] = timeit(load, 1, SUITE_ROUNDS, setup=drop_index) * 1000
+            metrics[f"sidecar_load_ms@{size}"] = timeit(load, 3, SUITE_ROUNDS) * 1000
+            metrics[f"cached_lookup_ms@{size}"] = timeit(
+                lambda: vocab_app.load_static_word_list(path), 100, SUITE_ROUNDS) * 1000
+    return metrics
+
+
+def run_suite(args):
+    latency = Latency(args.firestore_ms / 1000, args.gemini_ms / 1000, args.tts_ms / 1000)
+    results = {}
+    results.update(bench_schedule(args.history_sizes))
+    results.update(bench_word_list(args.word_sizes))
+    card_flow, dictionary_cache = bench_card_flow(latency, args.sessions)
+    results.update(card_flow)
+    results = {k: round(v, 4) for k, v in results.items()}
+    return {
+        "meta": {"created_at": datetime.now().isoformat(), "python": sys.version.split()[0],
+                 "latency_ms": {"firestore": args.firestore_ms, "gemini": args.gemini_ms, "tts": args.tts_ms}},
+        "metrics": results,
+        "caches": {"dictionary_sqlite": dictionary_cache}  # 只列出供參考，--check 不比對
+    }
+
+
+def compare(baseline, current, tolerance):
+    """回傳 (退步的指標 [(名稱, baseline, 目前)], baseline 沒有的指標 [名稱])
+
+    所有指標都是越小越好，對照組 (CONTROL_METRICS) 不檢查；慢了超過 tolerance 比例、且差距超過下限才算退步：
+    微基準 (名稱帶 @大小) 的下限是 ABSOLUTE_FLOOR_MS；端到端互動是一次模擬的 Firestore 來回，
+    慢不到一次來回的差距多半是 CPU 排程的抖動。
+    baseline 缺少的指標無從比較，另外列出 (通常表示新增了指標、需要重新產生 baseline)。
+    """
+    round_trip_ms = baseline.get("meta", {}).get("latency_ms", {}).get("firestore", 0)
+    regressions = []
+    for name, base in baseline["metrics"].items():
+        value = current["metrics"].get(name)
+        if value is None or base <= 0 or name.startswith(CONTROL_METRICS):
+            continue
+        if "@" not in name:
+            floor = max(ABSOLUTE_FLOOR_MS, round_trip_ms)
+        else:
+            floor = ABSOLUTE_FLOOR_MS * (1000 if name.split("@")[0].endswith("_us") else 1)
+        if value > base * (1 + tolerance) and value - base > floor:
+            regressions.append((name, base, value))
+    missing = [name for name in current["metrics"]
+               if name not in baseline["metrics"] and not name.startswith(CONTROL_METRICS)]
+    return regressions, missing
+
+
+def confirm_regressions(argv, baseline, regressions, tolerance):
+    """在新的 process 以相同參數重跑一次 suite，只留下兩次都退步的指標"""
+    argv = [arg for arg in argv if arg not in ("--check", "--save-baseline")]
+    out = subprocess.run([sys.executable, os.path.abspath(__file__)] + argv,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout
+    again, _ = compare(baseline, json.loads(out), tolerance)
+    confirmed = {name for name, _, _ in again}
+    return [r for r in regressions if r[0] in confirmed]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="效能基準測試")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_srs = sub.add_parser("srs", help="get_review_batch 全量掃描 vs 索引")
+    p_srs.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p_srs.add_argument("--repeat", type=int, default=20)
+
+    p_gemini = sub.add_parser("gemini-client", help="genai.configure 每次呼叫 vs client registry")
+    p_gemini.add_argument("--keys", type=int, default=10)
+    p_gemini.add_argument("--calls", type=int, default=200)
+
+    p_auth = sub.add_parser("auth", help="登入連線重用與 session 還原 (本地 Auth 模擬器)")
+    p_auth.add_argument("--logins", type=int, default=50)
+    p_auth.add_argument("--connect-ms", type=float, default=30, help="新連線的交握延遲")
+    p_auth.add_argument("--rtt-ms", type=float, default=10, help="每個請求的往返延遲")
+
+    p_suite = sub.add_parser("suite", help="完整基準測試 (本地替身)")
+    p_suite.add_argument("--baseline", default=DEFAULT_BASELINE)
+    p_suite.add_argument("--save-baseline", action="store_true", help="把結果寫入 baseline 檔")
+    p_suite.add_argument("--check", action="store_true", help="與 baseline 比對，退步超過容許值則失敗")
+    p_suite.add_argument("--tolerance", type=float, default=0.5, help="容許比 baseline 慢的比例")
+    p_suite.add_argument("--history-sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    p_suite.add_argument("--word-sizes", type=int, nargs="+", default=[10_000, 100_000])
+    p_suite.add_argument("--sessions", type=int, default=6)
+    p_suite.add_argument("--firestore-ms", type=float, default=20)
+    p_suite.add_argument("--gemini-ms", type=float, default=300)
+    p_suite.add_argument("--tts-ms", type=float, default=150)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parser.parse_args(argv)
+    if args.command == "suite":
+        current = run_suite(args)
+        print(json.dumps(current, indent=2, ensure_ascii=False))
+        if args.save_baseline:
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2, ensure_ascii=False)
+                f.write("\n")
+            print(f"已寫入 {args.baseline}", file=sys.stderr)
+        if args.check:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions, missing = compare(baseline, current, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} 項超過容許值，重跑一次確認...", file=sys.stderr)
+                regressions = confirm_regressions(argv, baseline, regressions, args.tolerance)
+            for name, base, value in regressions:
+                print(f"✗ {name}: {base} -> {value}", file=sys.stderr)
+            for name in missing:
+                print(f"✗ {name}: baseline 沒有此指標，請以 --save-baseline 重新產生", file=sys.stderr)
+            if regressions or missing:
+                return 1
+            print("✓ 沒有超過容許值的退步", file=sys.stderr)
+    elif args.command == "srs":
+        print(json.dumps(bench_srs(args.sizes, args.repeat), indent=2))
+    elif args.command == "gemini-client":
+        print(json.dumps(bench_gemini_client(args.keys, args.calls), indent=2))
+    elif args.command == "auth":
+        print(json.dumps(bench_auth(args.logins, args.connect_ms / 1000, args.rtt_ms / 1000), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
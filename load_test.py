@@ -0,0 +1,369 @@
+"""多使用者負載測試 (本地替身，不需 Firebase / Gemini / gTTS)
+
+用法：
+    python load_test.py [--concurrency 1 4 16 32] [--sessions 1] [--gemini-ms 300] [--mode server|apptest]
+
+每個模擬學習者跑一個獨立 session：登入 -> 抽詞 -> 逐張評分 -> 生成故事。
+每個並行等級輸出 sessions/sec、各互動延遲分佈與平均每個 session 的常駐記憶體 (RSS) 增量 (server 模式在所有 session 仍連線時量測)，
+用來估算單台節點容量並找出無法擴展的瓶頸。
+
+--mode server (預設)：fork 出一個真正的 Streamlit 伺服器 (已安裝替身)，所有學習者以瀏覽器前端相同的
+WebSocket 協定 (BackMsg / ForwardMsg) 同時連到這一個 process。腳本在伺服器的各 session 執行緒中並行，
+量到的就是正式部署的情況：共用的 lock、快取、GIL 與 session_state 記憶體都在同一個 process 中競爭，
+RSS 增量也是伺服器 process 每多一個 session 的成本。
+
+--mode apptest：每位學習者在各自 fork 出的 process 中以 Streamlit AppTest 執行 (共用磁碟上的字典 / 語音快取)。
+AppTest 每次 run 都會改寫全域的 Runtime._instance，無法在同一個 process 內並行，
+所以這個模式只量得到單一 session 的成本與磁碟 / 替身服務的競爭，看不到同一個伺服器 process 內
+lock、記憶體快取、GIL 與 session 記憶體的擴展限制；只用來在沒有 WebSocket 的環境下比較單一 session 的延遲。
+"""
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks import Latency, install_fakes, percentile, run_learner, write_word_file
+from online_vocab_app import Config
+
+GRADES = ["😓", "😊", "⚡", "❌"]
+
+
+def rss_bytes(pid="self"):
+    """process 的常駐記憶體 (Linux /proc)"""
+    with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+# =================================================================
+# server 模式：真正的 Streamlit 伺服器 + WebSocket 學習者
+# =================================================================
+class BrowserSession:
+    """以瀏覽器前端相同的 WebSocket 協定操作一個 Streamlit session"""
+
+    def __init__(self, url):
+        self.url = url
+        self.widgets = {}   # widget id -> (label, fragment_id)，目前畫面上的元件
+        self.inputs = {}    # widget id -> 文字輸入值 (與瀏覽器相同，每次重跑都送出)
+        self.query_string = ""
+        self._ws = None
+
+    async def __aenter__(self):
+        import websockets  # Streamlit 伺服器的相依套件
+        self._ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    def find(self, label):
+        for wid, (widget_label, fragment_id) in self.widgets.items():
+            if widget_label.startswith(label):
+                return wid, fragment_id
+        return None
+
+    def type_text(self, key, value):
+        wid = next(w for w in self.widgets if w.endswith("-" + key))
+        self.inputs[wid] = value
+
+    async def run(self, trigger=None, fragment_id=""):
+        """送出一次重跑，等到腳本 (含 st.rerun 接著觸發的重跑) 執行完畢；腳本拋出例外時 raise"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        rerun = msg.rerun_script
+        rerun.query_string = self.query_string
+        for wid, value in self.inputs.items():
+            if wid in self.widgets:
+                state = rerun.widget_states.widgets.add()
+                state.id, state.string_value = wid, value
+        if trigger:
+            state = rerun.widget_states.widgets.add()
+            state.id, state.trigger_value = trigger, True
+        if fragment_id:
+            rerun.fragment_id = fragment_id
+        await self._ws.send(msg.SerializeToString())
+
+        error = None
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self._ws.recv())
+            kind = fwd.WhichOneof("type")
+            if kind == "new_session":
+                # 整頁重跑清掉所有元件；fragment 重跑只清掉該 fragment 的元件
+                fragments = set(fwd.new_session.fragment_ids_this_run)
+                self.widgets = {w: v for w, v in self.widgets.items() if fragments and v[1] not in fragments}
+            elif kind == "page_info_changed":
+                self.query_string = fwd.page_info_changed.query_string
+            elif kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element
+                field = element.WhichOneof("type")
+                proto = getattr(element, field)
+                if field == "exception":
+                    error = proto.message
+                elif getattr(proto, "id", "").startswith("$$ID"):
+                    self.widgets[proto.id] = (getattr(proto, "label", ""), fwd.delta.fragment_id)
+            elif kind == "script_finished" and fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        if error:
+            raise RuntimeError(error)
+
+    async def click(self, label):
+        found = self.find(label)
+        if found is None:
+            raise LookupError(f"找不到按鈕 {label}")
+        await self.run(*found)
+
+
+async def ws_learner(url, email, sessions, story, before_close=None):
+    """一位學習者：與 benchmarks.run_learner 相同的流程，回傳 {互動: [秒...]}
+
+    before_close 為 coroutine function 時，學完後先 await 它才中斷連線 (用來在所有 session 都還連線時量 RSS)。
+    """
+    timings = {}
+
+    async def timed(name, action):
+        start = time.perf_counter()
+        await action
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+
+    async with BrowserSession(url) as page:
+        await timed("first_paint", page.run())
+        page.type_text("login_email", email)
+        page.type_text("login_pass", "password")
+        await timed("login", page.click("登入"))
+        for _ in range(sessions):
+            await timed("start_session", page.click("🚀"))
+            if page.find("👁️") is None:
+                break  # 今天的佇列已經學完
+            while page.find("👁️") is not None:
+                await timed("show_answer", page.click("👁️"))
+                await timed("card_to_card", page.click(random.choice(GRADES)))
+            if story:
+                # 同一組單字的故事已在快取中時直接顯示 (沒有按鈕)，改量測一次重繪
+                await timed("story", page.click("🪄") if page.find("🪄") else page.run())
+            await timed("back_home", page.click("🏠"))
+        if before_close is not None:
+            await before_close()
+    return timings
+
+
+def _serve(script, port):
+    """子 process：以繼承自父 process 的替身啟動 Streamlit 伺服器"""
+    from streamlit.web import bootstrap
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)  # 啟動訊息
+    flags = {"server_port": port, "server_address": "127.0.0.1", "server_headless": True,
+             "server_fileWatcherType": "none", "browser_gatherUsageStats": False, "logger_level": "error",
+             # 中斷的 session 立即清除，不會留到下一個並行等級的 RSS 基準中
+             "server_disconnectedSessionTTL": 0}
+    bootstrap.load_config_options(flags)
+    bootstrap.run(script, False, [], flags)
+
+
+def start_server(workdir, timeout=30):
+    """fork 出 Streamlit 伺服器並等到可以連線，回傳 (process, WebSocket URL)"""
+    script = os.path.join(workdir, "app.py")
+    with open(script, "w", encoding="utf-8") as f:
+        f.write("import online_vocab_app\nonline_vocab_app.main()\n")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = multiprocessing.get_context("fork").Process(target=_serve, args=(script, port), daemon=True)
+    proc.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                break
+        except OSError:
+            if time.monotonic() > deadline or not proc.is_alive():
+                proc.terminate()
+                raise RuntimeError("Streamlit 伺服器無法啟動")
+            time.sleep(0.1)
+    return proc, f"ws://127.0.0.1:{port}/_stcore/stream"
+
+
+def run_level_server(server, url, emails, sessions, story):
+    """同時連線 len(emails) 位學習者到同一個伺服器，回傳 (outcomes, elapsed)
+
+    RSS 在每位學習者都學完、但還沒中斷連線時取樣 (所有 session_state 仍在伺服器上)；
+    中斷後伺服器會清掉 session，那時再量只剩下共用快取的成長。
+    """
+    rss_connected = []
+
+    async def everyone():
+        remaining = len(emails)
+        all_studied = asyncio.Event()
+
+        def arrive():
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                rss_connected.append(rss_bytes(server.pid))
+                all_studied.set()
+
+        async def one(email):
+            arrived = False
+
+            async def hold():
+                nonlocal arrived
+                arrived = True
+                arrive()
+                await all_studied.wait()
+
+            try:
+                return {"email": email, "timings": await ws_learner(url, email, sessions, story, hold)}
+            except Exception as e:
+                if not arrived:
+                    arrive()  # 出錯的學習者不再等待，也不能讓其他人卡住
+                return {"email": email, "error": f"{type(e).__name__}: {e}"}
+
+        return await asyncio.gather(*(one(email) for email in emails))
+
+    rss_before = rss_bytes(server.pid)
+    start = time.perf_counter()
+    outcomes = asyncio.run(everyone())
+    elapsed = time.perf_counter() - start
+    rss_delta = rss_connected[0] - rss_before
+    for outcome in outcomes:
+        if "timings" in outcome:
+            outcome["rss_delta"] = rss_delta / len(emails)  # 伺服器 process 每個 session 的平均增量
+            outcome["server_rss"] = rss_connected[0]
+    return outcomes, elapsed
+
+
+# =================================================================
+# apptest 模式：每位學習者一個 process
+# =================================================================
+def _learner_process(email, sessions, story, start_event, results):
+    """子 process：等待開始訊號後跑一位學習者，把結果放進 queue"""
+    start_event.wait()
+    gc.collect()
+    rss_before = rss_bytes()
+    try:
+        timings = run_learner(email, sessions=sessions, story=story)
+    except Exception as e:
+        results.put({"email": email, "error": str(e)})
+        return
+    results.put({"email": email, "timings": timings, "rss_delta": rss_bytes() - rss_before})
+
+
+def run_level_apptest(emails, sessions, story):
+    """同時啟動 len(emails) 個學習者 process，回傳 (outcomes, elapsed)"""
+    ctx = multiprocessing.get_context("fork")  # 繼承父 process 已安裝的替身
+    start_event = ctx.Event()
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_learner_process, args=(email, sessions, story, start_event, queue))
+             for email in emails]
+    for p in procs:
+        p.start()
+
+    start = time.perf_counter()
+    start_event.set()  # 讓所有人同時開始，模擬尖峰
+    outcomes = [queue.get() for _ in procs]
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+    return outcomes, elapsed
+
+
+def summarize(concurrency, outcomes, elapsed):
+    ok = [o for o in outcomes if "timings" in o]
+    errors = [f"{o['email']}: {o['error']}" for o in outcomes if "error" in o]
+    merged = {}
+    for outcome in ok:
+        for name, values in outcome["timings"].items():
+            merged.setdefault(name, []).extend(values)
+    latency = {name: {"p50_ms": round(percentile(v, 0.50) * 1000, 2),
+                      "p95_ms": round(percentile(v, 0.95) * 1000, 2),
+                      "p99_ms": round(percentile(v, 0.99) * 1000, 2),
+                      "n": len(v)} for name, v in merged.items()}
+    completed = len(merged.get("back_home", []))  # 實際完成的輪數 (今天的佇列學完時會提早結束)
+    rss = [o["rss_delta"] for o in ok]
+    server_rss = [o["server_rss"] for o in ok if "server_rss" in o]
+    return {
+        "concurrency": concurrency,
+        "learners_ok": len(ok),
+        "errors": errors[:5],
+        "elapsed_sec": round(elapsed, 2),
+        "sessions_completed": completed,
+        "sessions_per_sec": round(completed / elapsed, 3) if elapsed else None,
+        "rss_per_session_kb": round(sum(rss) / len(rss) / 1024, 1) if rss else None,
+        # 所有 session 仍連線時伺服器的 RSS；並行數低時增量會被配置器歸還記憶體的 MB 級雜訊蓋過，可改比較各等級的總量
+        "server_rss_mb": round(max(server_rss) / 2 ** 20, 1) if server_rss else None,
+        "latency": latency
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多使用者負載測試")
+    parser.add_argument("--mode", choices=["server", "apptest"], default="server",
+                        help="server: 同一個 Streamlit 伺服器 process；apptest: 每位學習者一個 process")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--sessions", type=int, default=1, help="每位學習者完成幾輪")
+    parser.add_argument("--no-story", action="store_true", help="不生成故事")
+    parser.add_argument("--words", type=int, default=20000, help="模擬單字檔大小")
+    parser.add_argument("--firestore-ms", type=float, default=20)
+    parser.add_argument("--gemini-ms", type=float, default=300)
+    parser.add_argument("--tts-ms", type=float, default=150)
+    parser.add_argument("--output", default=None, help="結果另存為 JSON 檔")
+    args = parser.parse_args(argv)
+
+    latency = Latency(args.firestore_ms / 1000, args.gemini_ms / 1000, args.tts_ms / 1000)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        word_file = os.path.join(workdir, "full-word.json")
+        write_word_file(word_file, args.words)
+        Config.FULL_WORD_FILE = word_file
+        # 每日新字上限要足夠跑完指定的輪數，量到的才是學習流程而不是「今天已學完」
+        Config.DAILY_NEW_LIMIT = max(Config.DAILY_NEW_LIMIT, args.sessions * Config.SESSION_SIZE)
+        total = sum(args.concurrency)
+        users = [(f"uid-learner{i}", f"learner{i}@example.com") for i in range(total)]
+        install_fakes(latency, workdir, users=users + [("uid-warmup", "warmup@example.com")])
+
+        server, url = start_server(workdir) if args.mode == "server" else (None, None)
+        try:
+            if server is not None:
+                # 先跑一位不計入結果的學習者，讓匯入與共用快取的冷啟動成本不算在第一個並行等級
+                run_level_server(server, url, ["warmup@example.com"], 1, not args.no_story)
+            offset = 0
+            for level in args.concurrency:
+                emails = [f"learner{offset + i}@example.com" for i in range(level)]
+                offset += level
+                if server is not None:
+                    outcomes, elapsed = run_level_server(server, url, emails, args.sessions, not args.no_story)
+                else:
+                    outcomes, elapsed = run_level_apptest(emails, args.sessions, not args.no_story)
+                result = summarize(level, outcomes, elapsed) | {"mode": args.mode}
+                results.append(result)
+                print(f"並行 {level:>3}: {result['sessions_per_sec']} sessions/s | "
+                      f"卡片切換 p95 {result['latency'].get('card_to_card', {}).get('p95_ms')} ms | "
+                      f"RSS/session {result['rss_per_session_kb']} KB (伺服器 {result['server_rss_mb']} MB) | "
+                      f"錯誤 {len(result['errors'])}",
+                      file=sys.stderr)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join(10)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,27 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # 冷啟動報告：本模組 (含 streamlit) 的載入起點
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore
-import google.generativeai as genai
+import importlib
 import json
 import os
 import random
-import requests
-import time
+import secrets
+import sys
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import functools
+import mmap
+import heapq
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from gtts import gTTS
 import io
 import re
+# firebase_admin / google.generativeai / gTTS / requests 改由 lazy_import 在第一次使用時才載入
 
 
 # =================================================================
@@ -20,6 +31,80 @@ class Config:
     # 檔案路徑
     HISTORY_FILE = "vocab_history.json"
     FULL_WORD_FILE = "full-word.json"
+    DICT_CACHE_FILE = "dict_cache.sqlite3"
+    DICT_PACK_FILE = "dictionary.pack"  # 由 precompute.py 離線產生的字典檔
+    AUDIO_CACHE_DIR = ".audio_cache"
+
+    # 字典持久化快取設定
+    DICT_CACHE_MAX_ENTRIES = 50000   # 超過上限時依 LRU 淘汰
+    DICT_CACHE_SHARED = True         # True: 所有使用者共用同一份字典快取
+    PREFETCH_WORKERS = 4             # 所有 session 共用、開始學習時並行查詢字典的執行緒數 (不含背景預熱)
+
+    # 語音快取設定
+    AUDIO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 超過時淘汰最久未使用的檔案
+    AUDIO_WORKERS = 4
+
+    # 每輪與每日的學習量
+    SESSION_SIZE = 5           # 每輪幾個單字
+    REVIEW_QUOTA = 3           # 每輪最多幾個複習字，其餘為新字 (新字不夠時以複習字補滿)
+    DAILY_NEW_LIMIT = 20       # 每天最多學幾個新字
+    DAILY_REVIEW_LIMIT = 200   # 每天最多複習幾個到期字 (不含當天答錯重排的)
+
+    # 下一批單字的預先準備：學習進行中就選好下一批，並在背景預熱字典與語音
+    PIPELINE_NEXT_BATCH = True
+    PIPELINE_WORKERS = 16    # 所有 session 共用的預熱執行緒數 (每個單字一個查詢工作)
+    PERSIST_WORKERS = 4      # 所有 session 共用、在背景寫回每日佇列的執行緒數
+
+    # 故事 / 記憶法生成
+    STREAM_GENERATION = True            # 逐段顯示 AI 回應，縮短等待第一個字的時間
+    GENERATION_CACHE_MAX_ENTRIES = 1000  # 生成結果的 LRU 快取上限
+
+    # Gemini 連線重用 (每把 API Key 一組 client)
+    GEMINI_MAX_CLIENTS = 256     # 同時保留的 client 上限，超過時淘汰最久未使用的
+    GEMINI_CLIENT_IDLE_TTL = 900  # 閒置超過 N 秒的 client 會被關閉
+    GEMINI_RATE_PER_KEY = 1.0     # 每把 Key 每秒可發出的請求數 (token bucket)
+    GEMINI_BURST_PER_KEY = 5      # 每把 Key 可瞬間發出的請求數
+    GEMINI_MAX_RETRIES = 3        # 可重試錯誤 (配額、暫時性錯誤) 的重試次數
+    GEMINI_RETRY_BASE_DELAY = 0.5  # 退避基準秒數 (指數成長 + 隨機抖動)
+
+    # Firebase Auth：共用連線池；設定環境變數 FIREBASE_AUTH_EMULATOR_HOST 時改連本地模擬器
+    HTTP_POOL_SIZE = 20
+    HTTP_TIMEOUT = 10
+    AUTH_SESSION_TTL = 2 * 3600     # 重新整理頁面後可免登入還原的期限 (秒，閒置起算)；sid 是網址中的持有人憑證，刻意設短
+    AUTH_MAX_SESSIONS = 10000       # 伺服器記憶體中保留的登入 session 上限 (LRU)
+    TOKEN_REFRESH_MARGIN = 300      # ID token 到期前 N 秒就用 refresh token 換新
+
+    # 效能監控：每個操作保留最近 N 筆延遲計算 p50/p95/p99
+    TRACE_WINDOW = 1024
+    # 第一次畫面送出後，在背景預先載入 Firebase / Gemini / gTTS 等套件
+    WARM_UP_IMPORTS = True
+    # 可看到效能面板的帳號 (也可在 secrets 的 [admin] emails 設定)
+    ADMIN_EMAILS = []
+
+    # True: learning_data 改用陣列儲存 (CompactLearningStore)，大量使用者同時在線時節省記憶體
+    COMPACT_LEARNING_DATA = False
+
+    # 學習分析 (側邊欄)：未來 N 天的到期預測；記憶保留率快取 N 秒
+    ANALYTICS_FORECAST_DAYS = 30
+    ANALYTICS_RETENTION_TTL = 60
+
+    # 雲端同步 (write-behind)：累積變動後再批次寫入
+    SYNC_FLUSH_INTERVAL = 30   # 距上次寫入超過 N 秒就寫入
+    SYNC_FLUSH_MAX_DIRTY = 20  # 累積 N 個變動單字就寫入
+
+    # 本地評分日誌 (offline-first)：評分先寫入本地 append-only 日誌，再於背景同步到雲端
+    LOCAL_JOURNAL = True
+    JOURNAL_DIR = ".journal"      # 每位使用者一個子目錄，快照檔名為 HISTORY_FILE
+    JOURNAL_FSYNC = True          # 每筆事件都 fsync，process 當掉也不會遺失評分
+    JOURNAL_COMPACT_EVERY = 200   # 日誌超過 N 行時壓縮成快照
+
+    # 分片儲存：學習紀錄依到期日分散在 users/{uid}/progress 子集合，登入時只載入到期的分片
+    # 開啟後使用者第一次登入就會搬到分片 (單向)；搬過的使用者之後一律讀寫分片，關掉此設定只會停止搬移新的使用者。
+    # 搬移時把舊的 learning_data 欄位移到 users/{uid}/backup/learning_data (不再更新)，確認分片無誤後才從主文件刪除。
+    SHARDED_STORAGE = False
+    SHARD_PRELOAD_DAYS = 1     # 除了已到期，另外預先載入未來 N 天的分片
+    SEEN_SHARDS = 32           # 「學過哪些字」名單依雜湊分成 N 份，需要時才載入
+    FIRESTORE_BATCH_LIMIT = 400
 
     # 模型設定 (使用 Flash 模型以獲得最快速度)
     MODEL_NAME = 'models/gemini-3-flash-preview'
@@ -75,9 +160,7 @@ class Config:
         """
     }
 
-    @staticmethod
-    def load_css():
-        st.markdown("""
+    CSS = """
             <style>
             .stApp { background-color: #121212; color: #E0E0E0; }
             .word-card {
@@ -94,7 +177,15 @@ class Config:
             .definition { color: #B0B0B0; margin-top: 10px; font-size: 1em; }
             div.stButton > button { width: 100%; border-radius: 8px; font-weight: bold; }
             </style>
-        """, unsafe_allow_html=True)
+        """
+
+    @staticmethod
+    def load_css():
+        # 整頁重跑時才會執行；fragment 重跑不會經過這裡
+        st.markdown(Config.CSS, unsafe_allow_html=True)
+
+
+THEME_NAMES = list(Config.THEME_DATA.keys())
 
 
 # =================================================================
@@ -102,153 +193,1728 @@ class Config:
 # 說明：將耗時操作移出類別，改為獨立函式以便 Streamlit 快取
 # =================================================================
 
+class LatencyTracker:
+    """輕量的延遲與快取命中率統計 (執行緒安全，整個 process 共用)
+
+    每個操作保留最近 window 筆延遲 (滾動視窗) 計算百分位數，另外累計總次數、總時間與錯誤數。
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._samples = {}   # op -> deque[秒]
+        self._totals = {}    # op -> [count, sum, errors]
+        self._cache = {}     # cache name -> [hits, misses]
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds, error=False):
+        with self._lock:
+            samples = self._samples.get(op)
+            if samples is None:
+                samples = self._samples[op] = deque(maxlen=self.window)
+                self._totals[op] = [0, 0.0, 0]
+            samples.append(seconds)
+            totals = self._totals[op]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += int(error)
+
+    def record_cache(self, name, hit):
+        with self._lock:
+            counts = self._cache.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def trace(self, op):
+        """裝飾器：記錄函式每次呼叫的耗時"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = False
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    self.record(op, time.perf_counter() - start, error)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _percentile(sorted_values, q):
+        if not sorted_values: return 0.0
+        return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+    def snapshot(self):
+        """回傳 (操作統計 list, 快取統計 list)"""
+        with self._lock:
+            samples = {op: sorted(d) for op, d in self._samples.items()}
+            totals = {op: list(t) for op, t in self._totals.items()}
+            cache = {name: list(c) for name, c in self._cache.items()}
+        ops = []
+        for op in sorted(samples):
+            values = samples[op]
+            count, total, errors = totals[op]
+            ops.append({
+                "op": op, "count": count, "errors": errors, "sum_sec": total,
+                "p50_ms": self._percentile(values, 0.50) * 1000,
+                "p95_ms": self._percentile(values, 0.95) * 1000,
+                "p99_ms": self._percentile(values, 0.99) * 1000,
+            })
+        caches = []
+        for name in sorted(cache):
+            hits, misses = cache[name]
+            total = hits + misses
+            caches.append({"cache": name, "hits": hits, "misses": misses,
+                           "hit_ratio": hits / total if total else 0.0})
+        return ops, caches
+
+    def to_prometheus(self):
+        ops, caches = self.snapshot()
+        lines = ["# TYPE vocab_op_latency_seconds summary"]
+        for o in ops:
+            for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'vocab_op_latency_seconds{{op="{o["op"]}",quantile="{q}"}} {o[key] / 1000:.6f}')
+            lines.append(f'vocab_op_latency_seconds_sum{{op="{o["op"]}"}} {o["sum_sec"]:.6f}')
+            lines.append(f'vocab_op_latency_seconds_count{{op="{o["op"]}"}} {o["count"]}')
+        lines.append("# TYPE vocab_op_errors_total counter")
+        for o in ops:
+            lines.append(f'vocab_op_errors_total{{op="{o["op"]}"}} {o["errors"]}')
+        lines.append("# TYPE vocab_cache_requests_total counter")
+        for c in caches:
+            lines.append(f'vocab_cache_requests_total{{cache="{c["cache"]}",result="hit"}} {c["hits"]}')
+            lines.append(f'vocab_cache_requests_total{{cache="{c["cache"]}",result="miss"}} {c["misses"]}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        ops, caches = self.snapshot()
+        now = datetime.now().isoformat()
+        records = [dict(o, type="op", ts=now) for o in ops] + [dict(c, type="cache", ts=now) for c in caches]
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+
+class StartupProfiler:
+    """冷啟動耗時：依子系統記錄各步驟 (載入套件、建立連線...) 第一次執行所花的時間"""
+
+    def __init__(self):
+        self._steps = OrderedDict()  # (subsystem, step) -> seconds
+        self._lock = threading.Lock()
+
+    def record(self, subsystem, step, seconds):
+        """同一步驟只保留第一次 (冷啟動) 的時間"""
+        with self._lock:
+            self._steps.setdefault((subsystem, step), seconds)
+
+    def __contains__(self, key):
+        return key in self._steps
+
+    @contextmanager
+    def measure(self, subsystem, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(subsystem, step, time.perf_counter() - start)
+
+    def report(self):
+        """回傳 (各步驟, 各子系統合計)，時間單位為毫秒"""
+        with self._lock:
+            steps = list(self._steps.items())
+        rows = [{"subsystem": sub, "step": step, "ms": sec * 1000} for (sub, step), sec in steps]
+        totals = {}
+        for row in rows:
+            totals[row["subsystem"]] = totals.get(row["subsystem"], 0.0) + row["ms"]
+        return rows, totals
+
+
+# `streamlit run` 每次重跑都會重新執行整個檔案，以 cache_resource 保留 process 層級的單一實例
+@st.cache_resource
+def get_tracer():
+    return LatencyTracker(Config.TRACE_WINDOW)
+
+
+@st.cache_resource
+def get_startup_profiler():
+    return StartupProfiler()
+
+
+# 模組層級的參考：裝飾器在 import 時就需要它
+TRACER = get_tracer()
+STARTUP = get_startup_profiler()
+
+# 重量級套件：模組名稱 -> 所屬子系統 (冷啟動報告依此分組)
+LAZY_IMPORTS = {
+    "firebase_admin": "firebase",
+    "firebase_admin.credentials": "firebase",
+    "firebase_admin.firestore": "firebase",
+    "google.generativeai": "gemini",
+    "google.ai.generativelanguage": "gemini",
+    "google.api_core.exceptions": "gemini",
+    "gtts": "tts",
+    "numpy": "analytics",
+    "requests": "http",
+}
+
+
+def lazy_import(name):
+    """第一次使用時才載入模組並記錄耗時；已載入時 import_module 只是查表 (另一執行緒載入中則會等待)"""
+    if name in sys.modules:
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    STARTUP.record(LAZY_IMPORTS.get(name, name), f"import {name}", time.perf_counter() - start)
+    return module
+
+
+def _warm_up():
+    for name in LAZY_IMPORTS:
+        try:
+            lazy_import(name)
+        except Exception:
+            pass  # 缺少的套件等到真正使用時再報錯
+
+
+@st.cache_resource
+def warm_up_in_background():
+    """在背景執行緒預先載入 LAZY_IMPORTS (每個 process 只執行一次)，使用者登入時套件已就緒"""
+    thread = threading.Thread(target=_warm_up, daemon=True)
+    thread.start()
+    return thread
+
+
 @st.cache_resource
 def get_firebase_db():
     """快取 Firebase 連線，避免重複初始化"""
     try:
-        if not firebase_admin._apps:
-            # 優先嘗試讀取 Streamlit Secrets
-            if "firebase" in st.secrets:
-                cred = credentials.Certificate(dict(st.secrets["firebase"]))
-            # 其次嘗試讀取本地檔案
-            elif os.path.exists("firebase-key.json"):
-                cred = credentials.Certificate("firebase-key.json")
-            else:
-                return None
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
+        firebase_admin = lazy_import("firebase_admin")
+        credentials = lazy_import("firebase_admin.credentials")
+        firestore = lazy_import("firebase_admin.firestore")
+        with STARTUP.measure("firebase", "initialize_app"):
+            if not firebase_admin._apps:
+                # 優先嘗試讀取 Streamlit Secrets
+                if "firebase" in st.secrets:
+                    cred = credentials.Certificate(dict(st.secrets["firebase"]))
+                # 其次嘗試讀取本地檔案
+                elif os.path.exists("firebase-key.json"):
+                    cred = credentials.Certificate("firebase-key.json")
+                else:
+                    return None
+                firebase_admin.initialize_app(cred)
+            return firestore.client()
     except Exception as e:
         st.error(f"Firebase 連線錯誤: {e}")
         return None
 
 
-@st.cache_data(ttl=86400)  # 快取 24 小時
+class WordList:
+    """不可變的單字表 (tuple + 單字 -> 編號)，由 st.cache_resource 讓所有 session 共用同一份"""
+
+    def __init__(self, words):
+        self.words = tuple(dict.fromkeys(words))  # 去除重複，編號即為位置
+        self.index = {w: i for i, w in enumerate(self.words)}
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __getitem__(self, i):
+        return self.words[i]
+
+    def __contains__(self, word):
+        return word in self.index
+
+
+def _extract_word(item):
+    # 支援不同的 JSON 結構
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        value = item.get("value")
+        return (value.get("word") if isinstance(value, dict) else None) or item.get("word")
+    return None
+
+
+_JSON_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """逐一產生最外層 JSON 陣列的元素，不必一次把整個檔案解析成物件樹"""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # 略過空白與分隔符號
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            chunk = f.read(chunk_size)
+            buf, pos = buf[pos:] + chunk, 0
+            eof = not chunk
+        if pos >= len(buf):
+            return
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("單字檔最外層必須是 JSON 陣列")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            # 解析到緩衝區結尾時，數字等元素可能還沒讀完 (例如 "12." 後面的 "5" 在下一個 chunk)
+            complete = eof or (end < len(buf) and not (
+                isinstance(item, (int, float)) and buf[end] in _JSON_NUMBER_CHARS))
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # 元素被切在 chunk 邊界，讀更多資料再試
+            chunk = f.read(chunk_size)
+            buf, pos = buf[pos:] + chunk, 0
+            eof = not chunk
+            continue
+        yield item
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+class WordListIndex:
+    """單字表的二進位索引檔 (<單字檔>.idx)，來源檔變更 (大小或修改時間不同) 時才重建
+
+    格式：MAGIC | u64 來源大小 | u64 來源 mtime_ns | u32 單字數 | u32 offsets[n+1] | UTF-8 單字區
+    """
+
+    MAGIC = b"VOCABWL1"
+    HEADER = struct.Struct("<QQI")
+
+    @staticmethod
+    def path_for(filepath):
+        return filepath + ".idx"
+
+    @staticmethod
+    def fingerprint(filepath):
+        stat = os.stat(filepath)
+        return stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def read(cls, filepath):
+        """索引存在且與來源檔一致時回傳單字 list，否則回傳 None (截斷或損壞的索引也回傳 None，由呼叫端重建)"""
+        path = cls.path_for(filepath)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        if blob[:8] != cls.MAGIC:
+            return None
+        try:
+            size, mtime_ns, count = cls.HEADER.unpack_from(blob, 8)
+            if (size, mtime_ns) != cls.fingerprint(filepath):
+                return None
+            pos = 8 + cls.HEADER.size
+            offsets = struct.unpack_from(f"<{count + 1}I", blob, pos)
+            pos += 4 * (count + 1)
+            data = blob[pos:]
+            if offsets[-1] != len(data):
+                return None
+            return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+        except (struct.error, ValueError, UnicodeDecodeError):
+            return None
+
+    @classmethod
+    def write(cls, filepath, words):
+        encoded = [w.encode("utf-8") for w in words]
+        offsets = [0]
+        for e in encoded:
+            offsets.append(offsets[-1] + len(e))
+        size, mtime_ns = cls.fingerprint(filepath)
+        path = cls.path_for(filepath)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(cls.HEADER.pack(size, mtime_ns, len(encoded)))
+            f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+            f.write(b"".join(encoded))
+        os.replace(tmp_path, path)
+
+
+@st.cache_resource(max_entries=2)
+def _load_word_list(filepath, fingerprint):
+    """實際載入；fingerprint 參與快取鍵，來源檔變更後自動重新載入"""
+    words = WordListIndex.read(filepath)
+    if words is None:
+        with open(filepath, "r", encoding="utf-8") as f:
+            words = [w for w in (_extract_word(item) for item in iter_json_array(f)) if w]
+        try:
+            WordListIndex.write(filepath, words)
+        except OSError:
+            pass  # 唯讀環境寫不了索引也沒關係，下次再從 JSON 解析
+    return WordList(words)
+
+
 def load_static_word_list(filepath):
-    """快取本地單字檔讀取"""
+    """讀取本地單字檔，回傳所有 session 共用的唯讀 WordList"""
     if os.path.exists(filepath):
         try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                word_list = []
-                if isinstance(data, list):
-                    for item in data:
-                        # 支援不同的 JSON 結構
-                        if isinstance(item, str):
-                            word_list.append(item)
-                        else:
-                            val = item.get("value", {}).get("word") or item.get("word")
-                            if val: word_list.append(val)
-                return word_list
+            return _load_word_list(filepath, WordListIndex.fingerprint(filepath))
         except Exception as e:
             st.error(f"讀取單字檔失敗: {e}")
-            return []
-    return []
+    return WordList([])
+
+
+class DictionaryCache:
+    """以 SQLite 儲存的字典快取 (跨 process、跨重新部署，單字解釋不會過期)"""
+
+    EVICT_CHECK_EVERY = 100  # 每寫入 N 筆檢查一次容量，避免每次都 COUNT(*)
+    TOUCH_INTERVAL = 600     # last_access 超過 N 秒才更新，命中時多半只需讀取、不必取得寫入鎖
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        # WAL 模式讓多個 process (多台 replica 共用磁碟時) 可同時讀取
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS definitions (
+                word TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (word, model, prompt_hash, scope)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON definitions (last_access)")
+        self._conn.commit()
 
+    @staticmethod
+    def prompt_hash(template):
+        return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
 
-@st.cache_data(ttl=3600, show_spinner=False)  # 快取 1 小時
-def fetch_ai_definition(word, api_key):
-    """快取 API 查詢結果 (这是加速的關鍵)"""
-    if not api_key: return None
+    @staticmethod
+    def scope_for(api_key, shared):
+        """共用模式下所有人同一個 scope；否則以 API Key 的雜湊區隔 (不直接存 Key)"""
+        if shared or not api_key:
+            return "shared"
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def get(self, word, model, prompt_hash, scope):
+        key = (word, model, prompt_hash, scope)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, last_access FROM definitions WHERE word=? AND model=? AND prompt_hash=? AND scope=?",
+                key
+            ).fetchone()
+            TRACER.record_cache("dictionary_sqlite", row is not None)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            if now - row[1] > self.TOUCH_INTERVAL:
+                self._conn.execute(
+                    "UPDATE definitions SET last_access=? WHERE word=? AND model=? AND prompt_hash=? AND scope=?",
+                    (now,) + key
+                )
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, word, model, prompt_hash, scope, payload):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO definitions VALUES (?, ?, ?, ?, ?, ?)",
+                (word, model, prompt_hash, scope, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_CHECK_EVERY == 0:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """超過容量時刪除最久未使用的項目 (呼叫端需持有 lock)"""
+        count = self._conn.execute("SELECT COUNT(*) FROM definitions").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM definitions WHERE rowid IN "
+                "(SELECT rowid FROM definitions ORDER BY last_access ASC LIMIT ?)", (overflow,)
+            )
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM definitions").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+class TokenBucket:
+    """執行緒安全的 Token Bucket 限流器 (rate: 每秒補充的 token 數)"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """取得 token，不足時阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class DictionaryPack:
+    """唯讀的預先計算字典檔 (mmap + 索引，查詢不需呼叫 API)
+
+    檔案格式：MAGIC | u32 meta 長度 | meta JSON | u32 索引筆數 |
+    索引 (u16 單字長度, 單字, u64 offset, u32 長度)* | 資料區 (JSON)*
+    """
+
+    MAGIC = b"VOCABPK1"
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != self.MAGIC:
+            raise ValueError(f"{path} 不是有效的字典檔")
+        pos = 8
+        (meta_len,) = struct.unpack_from("<I", self._mm, pos)
+        pos += 4
+        self.meta = json.loads(self._mm[pos:pos + meta_len].decode("utf-8"))
+        pos += meta_len
+        (count,) = struct.unpack_from("<I", self._mm, pos)
+        pos += 4
+        self._index = {}
+        for _ in range(count):
+            (word_len,) = struct.unpack_from("<H", self._mm, pos)
+            pos += 2
+            word = self._mm[pos:pos + word_len].decode("utf-8")
+            pos += word_len
+            self._index[word] = struct.unpack_from("<QI", self._mm, pos)
+            pos += 12
+        self._data_start = pos
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, word):
+        return word in self._index
+
+    def matches(self, model, prompt_hash):
+        """字典檔是否由目前的模型與 prompt 產生"""
+        return self.meta.get("model") == model and self.meta.get("prompt_hash") == prompt_hash
+
+    def get(self, word):
+        loc = self._index.get(word)
+        if loc is None: return None
+        offset, length = loc
+        start = self._data_start + offset
+        return json.loads(self._mm[start:start + length].decode("utf-8"))
+
+    @classmethod
+    def write(cls, path, entries, model, prompt_hash):
+        """將 {word: entry} 寫成字典檔 (先寫暫存檔再原子替換)"""
+        words = sorted(entries)
+        blobs = [json.dumps(entries[w], ensure_ascii=False).encode("utf-8") for w in words]
+        meta = json.dumps({"model": model, "prompt_hash": prompt_hash, "count": len(words),
+                           "created_at": datetime.now().isoformat()}).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack("<I", len(meta)))
+            f.write(meta)
+            f.write(struct.pack("<I", len(words)))
+            offset = 0
+            for word, blob in zip(words, blobs):
+                encoded = word.encode("utf-8")
+                f.write(struct.pack("<H", len(encoded)))
+                f.write(encoded)
+                f.write(struct.pack("<QI", offset, len(blob)))
+                offset += len(blob)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
 
+
+@st.cache_resource
+def get_dictionary_pack():
+    """載入預先計算的字典檔；不存在或與目前 prompt 不符時回傳 None"""
+    if not os.path.exists(Config.DICT_PACK_FILE):
+        return None
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(Config.MODEL_NAME)
-        prompt = Config.PROMPTS["dictionary"].format(word=word)
+        pack = DictionaryPack(Config.DICT_PACK_FILE)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not pack.matches(Config.MODEL_NAME, DictionaryCache.prompt_hash(Config.PROMPTS["dictionary"])):
+        return None
+    return pack
+
+
+@st.cache_resource
+def get_dictionary_cache():
+    """整個 process 共用一個字典快取連線"""
+    return DictionaryCache(Config.DICT_CACHE_FILE, Config.DICT_CACHE_MAX_ENTRIES)
+
+
+class AudioCache:
+    """以內容定址 (text + lang + engine 的雜湊) 儲存在磁碟的 MP3 快取
+
+    總大小在記憶體中估算 (第一次寫入時掃描目錄一次，之後每次寫入累加)，估計值超過上限時才重新掃描並淘汰，
+    大量寫入時不必反覆掃描整個目錄。其他 process 寫入的檔案要到下次掃描才會計入。
+    max_bytes 為 None 時不設上限 (離線預先合成用)。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total = None   # 目錄總大小的估計值 (bytes)
+        self._lock = threading.Lock()
+        self._bg_pool = None  # warm_in_background 共用的執行緒池 (第一次用到才建立)
+        self._pending = set()  # 已送進背景池、尚未合成完的 (text, lang)
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text, lang, engine):
+        return hashlib.sha256(f"{engine}|{lang}|{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".mp3")
+
+    def has(self, text, lang="en", engine="gtts"):
+        """是否已快取 (只檢查檔案是否存在，不讀內容、不更新使用時間)"""
+        return os.path.exists(self._path(self.key(text, lang, engine)))
+
+    def get(self, text, lang="en", engine="gtts"):
+        path = self._path(self.key(text, lang, engine))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            TRACER.record_cache("audio", False)
+            return None
+        TRACER.record_cache("audio", True)
+        try:
+            os.utime(path)  # 以 mtime 當作最近使用時間
+        except OSError:
+            pass
+        return data
+
+    def put(self, text, data, lang="en", engine="gtts"):
+        path = self._path(self.key(text, lang, engine))
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.max_bytes is None: return
+        with self._lock:
+            if self._total is not None:
+                self._total += len(data)
+            check = self._total is None or self._total > self.max_bytes
+        if check:
+            self.evict()
+
+    @staticmethod
+    @TRACER.trace("tts.synthesize")
+    def synthesize(text, lang="en"):
+        """呼叫 gTTS 產生 MP3 bytes (較慢，需要網路)"""
+        tts = lazy_import("gtts").gTTS(text=text, lang=lang)
+        fp = io.BytesIO()
+        tts.write_to_fp(fp)
+        return fp.getvalue()
+
+    def get_or_synthesize(self, text, lang="en"):
+        data = self.get(text, lang)
+        if data is None:
+            data = self.synthesize(text, lang)
+            self.put(text, data, lang)
+        return data
+
+    def evict(self):
+        """掃描目錄更新總大小；超過上限時刪除最久未使用的檔案直到低於上限的 90%"""
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = self._total = sum(size for _, size, _ in files)
+            if self.max_bytes is None or total <= self.max_bytes: return
+            files.sort()
+            target = self.max_bytes * 0.9
+            for _, size, path in files:
+                if total <= target: break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total = total
+
+    def warm(self, texts, lang="en", workers=None, on_done=None):
+        """批次預先合成尚未快取的語音，回傳成功數
+
+        只保留有限數量的工作在佇列中：中斷 (Ctrl-C) 時取消還沒開始的，只等正在合成的完成。
+        """
+        missing = (t for t in dict.fromkeys(texts) if not self.has(t, lang))
+        workers = workers or Config.AUDIO_WORKERS
+        done = 0
+        pool = ThreadPoolExecutor(max_workers=workers)
+        in_flight = set()
+        try:
+            while True:
+                while len(in_flight) < workers * 2:
+                    text = next(missing, None)
+                    if text is None: break
+                    in_flight.add(pool.submit(self.get_or_synthesize, text, lang))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    ok = future.exception() is None
+                    done += ok
+                    if on_done: on_done(ok)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        return done
+
+    def _synthesize_pending(self, text, lang):
+        try:
+            self.get_or_synthesize(text, lang)
+        finally:
+            with self._lock:
+                self._pending.discard((text, lang))
+
+    def warm_in_background(self, texts, lang="en"):
+        """交給共用的背景執行緒池合成 (所有 session 共用，不會每次呼叫都開新的執行緒)，已在排隊的不重複送出"""
+        if self._bg_pool is None:
+            with self._lock:
+                if self._bg_pool is None:
+                    self._bg_pool = ThreadPoolExecutor(max_workers=Config.AUDIO_WORKERS, thread_name_prefix="audio")
+        for text in dict.fromkeys(texts):
+            if self.has(text, lang):
+                continue
+            with self._lock:
+                if (text, lang) in self._pending: continue
+                self._pending.add((text, lang))
+            self._bg_pool.submit(self._synthesize_pending, text, lang)
+
+
+@st.cache_resource
+def get_audio_cache():
+    return AudioCache(Config.AUDIO_CACHE_DIR, Config.AUDIO_CACHE_MAX_BYTES)
+
+
+class GenerationCache:
+    """故事 / 記憶法生成結果的 LRU 快取 (執行緒安全，所有 session 共用)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def mnemonic_key(word, theme):
+        return ("mnemonic", word, theme)
+
+    @staticmethod
+    def story_key(theme, sub_theme, words):
+        return ("story", theme, sub_theme, tuple(sorted(set(words))))
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            TRACER.record_cache(f"generation_{key[0]}", value is not None)
+            if value is None:
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+@st.cache_resource
+def get_generation_cache():
+    return GenerationCache(Config.GENERATION_CACHE_MAX_ENTRIES)
+
+
+class GeminiClientRegistry:
+    """依 API Key 重用 Gemini client 與 model (執行緒安全)
+
+    genai.configure 會修改整個 process 共用的設定，不同使用者的 Key 同時呼叫時會互相覆蓋，
+    而且每次 configure 都會丟掉既有連線。這裡改為每把 Key 建立自己的 GenerativeServiceClient，
+    並把它指定給 GenerativeModel，連線可在多次呼叫間重用。
+    """
+
+    def __init__(self, max_clients, idle_ttl):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.created = 0
+        self._entries = OrderedDict()  # key hash -> {"client", "models", "last_used"}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key_id(api_key):
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _create_client(api_key):
+        glm = lazy_import("google.ai.generativelanguage")
+        with STARTUP.measure("gemini", "create_client"):
+            return glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+    @contextmanager
+    def lease(self, api_key, model_name=None):
+        """借用此 Key 的 model；借用期間 client 不會被關閉 (被淘汰時等最後一位使用者歸還才關閉)"""
+        entry, model = self._acquire(api_key, model_name or Config.MODEL_NAME)
+        try:
+            yield model
+        finally:
+            self._release(entry)
+
+    def _acquire(self, api_key, model_name):
+        key_id = self._key_id(api_key)
+        now = time.monotonic()
+        closing = []
+        client = None
+        while True:
+            with self._lock:
+                closing.extend(self._evict_idle(now))
+                entry = self._entries.get(key_id)
+                if entry is None and client is not None:
+                    entry = {"client": client, "models": {}, "last_used": now, "in_use": 0, "retired": False}
+                    self._entries[key_id] = entry
+                    self.created += 1
+                    client = None
+                    while len(self._entries) > self.max_clients:
+                        closing.extend(self._retire(self._entries.popitem(last=False)[1]))
+                if entry is not None:
+                    entry["last_used"] = now
+                    entry["in_use"] += 1
+                    self._entries.move_to_end(key_id)
+                    model = entry["models"].get(model_name)
+                    if model is None:
+                        model = lazy_import("google.generativeai").GenerativeModel(model_name)
+                        model._client = entry["client"]  # 使用此 Key 專屬的 client，而非全域預設
+                        entry["models"][model_name] = model
+                    break
+            # 在 lock 外建立 client，第一次使用某把 Key 時不會擋住其他 Key
+            client = self._create_client(api_key)
+        if client is not None:
+            closing.append(client)  # 同一把 Key 已由其他執行緒先建立，用不到這個
+        for old in closing:
+            self._close(old)
+        return entry, model
+
+    def _release(self, entry):
+        with self._lock:
+            entry["in_use"] -= 1
+            close = entry["retired"] and entry["in_use"] == 0
+        if close:
+            self._close(entry["client"])
+
+    @staticmethod
+    def _retire(entry):
+        """標記已移出的項目 (呼叫端需持有 lock)，沒有人在使用時回傳待關閉的 client"""
+        entry["retired"] = True
+        return [entry["client"]] if entry["in_use"] == 0 else []
+
+    def _evict_idle(self, now):
+        """移除閒置過久的項目 (呼叫端需持有 lock)，回傳待關閉的 client"""
+        expired = [k for k, e in self._entries.items() if now - e["last_used"] > self.idle_ttl]
+        return [client for k in expired for client in self._retire(self._entries.pop(k))]
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.transport.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self._entries)
+
 
-        # 設定 response_mime_type 為 application/json (Gemini 新功能，更穩)
-        response = model.generate_content(
+@st.cache_resource
+def get_gemini_registry():
+    return GeminiClientRegistry(Config.GEMINI_MAX_CLIENTS, Config.GEMINI_CLIENT_IDLE_TTL)
+
+
+class SingleFlight:
+    """合併同時間的相同請求：同一個 key 只有第一個呼叫者真正執行，其他人等待並共用結果 (含例外)"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class KeyRateLimiter:
+    """每把 API Key 各自一個 TokenBucket"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, api_key):
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        with self._lock:
+            bucket = self._buckets.get(key_id)
+            if bucket is None:
+                bucket = self._buckets[key_id] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+
+@st.cache_resource
+def get_key_rate_limiter():
+    return KeyRateLimiter(Config.GEMINI_RATE_PER_KEY, Config.GEMINI_BURST_PER_KEY)
+
+
+@functools.cache
+def retryable_errors():
+    """可重試的 Gemini 錯誤 (只在發生例外時才需要，因此延後載入 google.api_core)"""
+    google_exceptions = lazy_import("google.api_core.exceptions")
+    return (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    )
+
+
+def call_gemini(api_key, fn, limiter=None):
+    """依 Key 限流後呼叫 fn()；可重試的錯誤以指數退避 + 隨機抖動 (full jitter) 重試
+
+    limiter 預設為 App 共用的 get_key_rate_limiter()；離線工具可傳入自己的 KeyRateLimiter。
+    """
+    limiter = limiter or get_key_rate_limiter()
+    for attempt in range(Config.GEMINI_MAX_RETRIES + 1):
+        limiter.acquire(api_key)
+        try:
+            return fn()
+        except retryable_errors():
+            if attempt == Config.GEMINI_MAX_RETRIES:
+                raise
+            time.sleep(random.uniform(0, Config.GEMINI_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _dictionary_cache_key(api_key):
+    """回傳 (model, prompt_hash, scope)，與單字組成快取鍵"""
+    prompt_hash = DictionaryCache.prompt_hash(Config.PROMPTS["dictionary"])
+    scope = DictionaryCache.scope_for(api_key, Config.DICT_CACHE_SHARED)
+    return Config.MODEL_NAME, prompt_hash, scope
+
+
+def _lookup_definition(word, key):
+    """依序查詢預先計算字典檔與持久化快取，皆未命中回傳 None"""
+    pack = get_dictionary_pack()
+    if pack is not None:
+        entry = pack.get(word)
+        TRACER.record_cache("dictionary_pack", entry is not None)
+        if entry is not None:
+            return entry
+    return get_dictionary_cache().get(word, *key)
+
+
+@TRACER.trace("gemini.request_definition")
+def _request_ai_definition(word, api_key, limiter=None):
+    """實際呼叫 Gemini 查詢單字 (不碰 st.*，可在背景執行緒使用；失敗時拋出例外)"""
+    prompt = Config.PROMPTS["dictionary"].format(word=word)
+
+    # 設定 response_mime_type 為 application/json (Gemini 新功能，更穩)
+    with get_gemini_registry().lease(api_key) as model:
+        response = call_gemini(api_key, lambda: model.generate_content(
             prompt,
             generation_config={"response_mime_type": "application/json"}
-        )
+        ), limiter)
+    result = json.loads(response.text.strip())
+    if not isinstance(result, dict) or not result.get("definition"):
+        raise ValueError(f"字典回應格式不正確: {response.text[:100]}")
+    return result
+
+
+def _resolve_definition(word, api_key, key):
+    """快取未命中時查詢 API：同時間相同的查詢只送出一次，且只有成功結果才寫入快取"""
+    def load():
+        # 等待期間可能已有其他請求寫入快取
+        cached = _lookup_definition(word, key)
+        if cached is not None:
+            return cached
+        result = _request_ai_definition(word, api_key)
+        get_dictionary_cache().put(word, *key, result)
+        return result
+    return get_single_flight().do(("definition", word) + key, load)
+
+
+def _definition_error(e):
+    # 如果解析失敗，回傳一個安全值 (失敗結果不寫入快取)
+    return {
+        "phonetic": "/Error/",
+        "definition": "查詢失敗，請重試",
+        "example": f"System Error: {str(e)}"
+    }
+
 
-        text = response.text.strip()
-        return json.loads(text)
+@TRACER.trace("gemini.fetch_definition")
+def fetch_ai_definition(word, api_key):
+    """先查預先計算字典檔與持久化快取 (不需 API Key)，未命中且有 Key 才呼叫 API (这是加速的關鍵)"""
+    key = _dictionary_cache_key(api_key)
+    cached = _lookup_definition(word, key)
+    if cached is not None:
+        return cached
+    if not api_key: return None
+
+    try:
+        return _resolve_definition(word, api_key, key)
     except Exception as e:
-        # 如果解析失敗，回傳一個安全值
-        return {
-            "phonetic": "/Error/",
-            "definition": "查詢失敗，請重試",
-            "example": f"System Error: {str(e)}"
-        }
+        return _definition_error(e)
+
+
+@st.cache_resource
+def get_prefetch_executor():
+    # 前景查詢專用且所有 session 共用：執行緒總數固定，也不必排在其他 session 的背景預熱後面
+    return ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def _prime_dictionary_resources():
+    """在主執行緒先取得字典查詢用到的共用物件 (cache_resource)，背景執行緒直接拿到快取好的實例"""
+    get_single_flight(), get_key_rate_limiter(), get_gemini_registry(), get_prefetch_executor()
+    get_dictionary_pack(), get_dictionary_cache()
+
+
+@TRACER.trace("gemini.fetch_definitions_batch")
+def fetch_ai_definitions(words, api_key):
+    """批次查詢：快取命中直接回傳，其餘交給共用的執行緒池並行呼叫 API
+
+    回傳 {word: 結果}；查詢失敗 (或沒有 API Key 且快取未命中) 的單字不會出現在結果中，由呼叫端個別重試。
+    """
+    if not words: return {}
+
+    key = _dictionary_cache_key(api_key)
+    results = {}
+    missing = []
+    for word in words:
+        cached = _lookup_definition(word, key)
+        if cached is not None:
+            results[word] = cached
+        elif word not in missing:
+            missing.append(word)
+
+    if missing and api_key:
+        _prime_dictionary_resources()
+        pool = get_prefetch_executor()
+        futures = {word: pool.submit(_resolve_definition, word, api_key, key) for word in missing}
+        for word, future in futures.items():
+            try:
+                results[word] = future.result()
+            except Exception:
+                continue  # 單一單字失敗不影響其他單字
+    return results
 
 
 # =================================================================
 # MODULE 3: 服務層 (Services)
 # =================================================================
+@st.cache_resource
+def get_http_session():
+    """共用的 requests.Session：連線池 + keep-alive，重複登入時不必每次重新建立 TCP / TLS 連線"""
+    requests = lazy_import("requests")
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=Config.HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class AuthSessionStore:
+    """登入 session (伺服器記憶體，LRU + 閒置期限)，讓重新整理頁面後不必重新輸入密碼
+
+    瀏覽器端只在網址帶不透明的 session id (st.query_params["sid"])，refresh token 不離開伺服器。
+    驗證過的 ID token 在到期前直接沿用；快到期時才用 refresh token 向 Secure Token API 換新。
+
+    注意：sid 等同持有人憑證 —— 拿到網址 (瀏覽紀錄、分享連結、Referer) 的人就能登入。
+    因此 sid 只能用一次：每次還原都換發新的 sid 並作廢舊的，外流的舊網址在下一次重新整理後即失效
+    (若被搶先使用，本人會被要求重新登入)；閒置期限也刻意設短 (Config.AUTH_SESSION_TTL)。
+    """
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # sid -> {"uid", "email", "id_token", "refresh_token", "expires_at", "last_used"}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _token_fields(res):
+        return {"id_token": res["idToken"], "refresh_token": res["refreshToken"],
+                "expires_at": time.time() + int(res.get("expiresIn", 3600))}
+
+    def _put(self, entry):
+        sid = secrets.token_urlsafe(24)
+        with self._lock:
+            self._sessions[sid] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return sid
+
+    def create(self, res):
+        """以登入 / 註冊的回應建立 session，回傳 sid"""
+        return self._put(dict(self._token_fields(res), uid=res["localId"], email=res["email"], last_used=time.time()))
+
+    def _take(self, sid):
+        """取出並作廢 sid (單次使用)；不存在或閒置過久回傳 None"""
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+        if entry is None or time.time() - entry["last_used"] > self.ttl:
+            return None
+        return entry
+
+    def discard(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def restore(self, sid, refresh):
+        """作廢舊 sid 並換發新的，回傳 (new_sid, session)；ID token 快到期時呼叫 refresh(refresh_token) 換新，失敗回傳 None"""
+        entry = self._take(sid)
+        if entry is None:
+            return None
+        if entry["expires_at"] - time.time() > Config.TOKEN_REFRESH_MARGIN:
+            TRACER.record_cache("auth_token", True)
+        else:
+            TRACER.record_cache("auth_token", False)
+            res = refresh(entry["refresh_token"])
+            if "error" in res:
+                return None
+            entry.update(self._token_fields(res))
+        entry["last_used"] = time.time()
+        return self._put(entry), dict(entry)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+@st.cache_resource
+def get_auth_sessions():
+    return AuthSessionStore(Config.AUTH_MAX_SESSIONS, Config.AUTH_SESSION_TTL)
+
+
 class FirebaseService:
-    def __init__(self):
-        self.db = get_firebase_db()
+    def __init__(self, db=None):
+        # 可注入本地替身 (例如測試用的假 Firestore)；未指定時第一次用到才連線，登入頁不必載入 firebase_admin
+        self._db = db
         self.api_key = None
         # 嘗試從 secrets 讀取預設 key (如果有的話)
         if "firebase" in st.secrets and "api_key" in st.secrets["firebase"]:
             self.api_key = st.secrets["firebase"]["api_key"]
 
-    def auth_user(self, email, password, is_login=True):
-        if not self.api_key:
-            return {"error": {"message": "Firebase API Key not configured"}}
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_firebase_db()
+        return self._db
 
-        url_type = "signInWithPassword" if is_login else "signUp"
-        url = f"https://identitytoolkit.googleapis.com/v1/accounts:{url_type}?key={self.api_key}"
-        payload = {"email": email, "password": password, "returnSecureToken": True}
+    @staticmethod
+    def _auth_endpoints():
+        """(Identity Toolkit, Secure Token) 的 base URL；有 FIREBASE_AUTH_EMULATOR_HOST 時改連本地模擬器"""
+        emulator = os.environ.get("FIREBASE_AUTH_EMULATOR_HOST")
+        if emulator:
+            return (f"http://{emulator}/identitytoolkit.googleapis.com/v1",
+                    f"http://{emulator}/securetoken.googleapis.com/v1")
+        return "https://identitytoolkit.googleapis.com/v1", "https://securetoken.googleapis.com/v1"
+
+    @staticmethod
+    def _post(url, **kwargs):
         try:
-            res = requests.post(url, json=payload, timeout=10)  # 加上 timeout
+            res = get_http_session().post(url, timeout=Config.HTTP_TIMEOUT, **kwargs)
             return res.json()
         except Exception as e:
             return {"error": {"message": str(e)}}
 
-    def load_user_data(self, uid):
-        if not self.db: return {}, None
-        try:
-            doc = self.db.collection("users").document(uid).get()
-            if doc.exists:
-                data = doc.to_dict()
-                return data.get("learning_data", {}), data.get("api_key", None)
-        except Exception:
-            pass
-        return {}, None
+    @TRACER.trace("auth.sign_in")
+    def auth_user(self, email, password, is_login=True):
+        if not self.api_key:
+            return {"error": {"message": "Firebase API Key not configured"}}
+
+        url_type = "signInWithPassword" if is_login else "signUp"
+        base, _ = self._auth_endpoints()
+        payload = {"email": email, "password": password, "returnSecureToken": True}
+        return self._post(f"{base}/accounts:{url_type}?key={self.api_key}", json=payload)
 
-    def save_data(self, uid, data):
+    @TRACER.trace("auth.refresh")
+    def refresh_token(self, refresh_token):
+        """以 refresh token 換新的 ID token，回傳與 auth_user 相同的欄位 (localId / idToken / refreshToken / expiresIn)"""
+        if not self.api_key:
+            return {"error": {"message": "Firebase API Key not configured"}}
+        _, base = self._auth_endpoints()
+        res = self._post(f"{base}/token?key={self.api_key}",
+                         data={"grant_type": "refresh_token", "refresh_token": refresh_token})
+        if "error" in res:
+            return res
+        return {"localId": res["user_id"], "idToken": res["id_token"],
+                "refreshToken": res["refresh_token"], "expiresIn": res["expires_in"]}
+
+    @TRACER.trace("firestore.save_changes")
+    def save_changes(self, uid, changes):
+        """只寫入有變動的單字：merge=True 會深層合併 learning_data，其他單字的欄位不受影響"""
+        if not self.db or not changes: return
+        batch = self.db.batch()
+        batch.set(self.db.collection("users").document(uid), {"learning_data": changes}, merge=True)
+        batch.commit()
+
+    @TRACER.trace("firestore.save_daily_queue")
+    def save_daily_queue(self, uid, queue):
         if self.db:
-            self.db.collection("users").document(uid).set({"learning_data": data}, merge=True)
+            # 每次都寫入完整的 day / reviews / new，陣列在 merge 時整個取代
+            self.db.collection("users").document(uid).set({"daily_queue": queue}, merge=True)
 
     def save_api_key(self, uid, api_key):
         if self.db:
+            firestore = lazy_import("firebase_admin.firestore")
             if api_key is None:
                 self.db.collection("users").document(uid).update({"api_key": firestore.DELETE_FIELD})
             else:
                 self.db.collection("users").document(uid).set({"api_key": api_key}, merge=True)
 
 
+class ShardedProgress:
+    """分片儲存的學習紀錄 (每位使用者一個實例，存在 session_state)
+
+    - users/{uid}/progress/{YYYY-MM-DD}: {"day", "words": {word: data}, "updated_at"}
+      依 next_review 的日期分桶，登入時只查詢 day <= 今天 + SHARD_PRELOAD_DAYS 的分片。
+    - users/{uid}/seen/{bucket}: {"words": [...]}，依單字雜湊分桶，用來判斷
+      未載入的單字是否學過，只在抽新字時才載入對應的桶。
+    - users/{uid}: {"api_key", "storage", "learned_count", "daily_queue"}，登入時只讀這幾個欄位
+    舊版把所有紀錄放在 users/{uid}.learning_data 的使用者，在 SHARDED_STORAGE 開啟時第一次登入自動搬移
+    (舊欄位移到 users/{uid}/backup/learning_data、不再更新)；沒有搬移的使用者 sharded 為 False，由呼叫端改用單一文件讀寫。
+    """
+
+    VERSION = "sharded-v1"
+    ALWAYS_DUE = "0000-00-00"  # 沒有 next_review 的紀錄
+    PROFILE_FIELDS = ["api_key", "storage", "learned_count", "daily_queue"]
+
+    def __init__(self, db, uid):
+        self.db = db
+        self.uid = uid
+        self.learned_count = 0
+        self.sharded = False
+        self._bucket_of = {}     # word -> 目前 Firestore 上所在的日期分片
+        self._stale = {}         # word -> [日期分片]，load 時發現的重複紀錄，下次寫入時刪除
+        self._loaded_until = None  # load 讀到的最後一天，之後的分片沒有載入
+        self._seen = {}          # seen bucket -> set(words)，已載入的部分
+        self._lock = threading.Lock()
+
+    def _user_ref(self):
+        return self.db.collection("users").document(self.uid)
+
+    @classmethod
+    def day_of(cls, data):
+        next_review = data.get("next_review", "")
+        return next_review[:10] if next_review else cls.ALWAYS_DUE
+
+    @staticmethod
+    def seen_bucket(word):
+        return f"{zlib.crc32(word.encode('utf-8')) % Config.SEEN_SHARDS:02d}"
+
+    @TRACER.trace("firestore.load_shards")
+    def load(self, migrate=True):
+        """回傳 (learning_data, api_key, daily_queue)；只包含已到期與近期的分片
+
+        尚未搬移的使用者：migrate 為 True 時搬到分片，否則直接回傳單一文件的 learning_data (sharded 保持 False)。
+        """
+        doc = self._user_ref().get(field_paths=self.PROFILE_FIELDS)
+        profile = doc.to_dict() if doc.exists else {}
+        api_key, daily_queue = profile.get("api_key"), profile.get("daily_queue")
+
+        if profile.get("storage") != self.VERSION:
+            legacy = {}
+            if doc.exists:
+                # 尚未搬移：另外讀取整份 learning_data (搬過的使用者不必下載)
+                legacy = (self._user_ref().get(field_paths=["learning_data"]).to_dict() or {}).get("learning_data", {})
+            if migrate:
+                self._migrate(legacy)
+            return dict(legacy), api_key, daily_queue
+
+        self.sharded = True
+        self.learned_count = profile.get("learned_count", 0)
+        cutoff = (datetime.now() + timedelta(days=Config.SHARD_PRELOAD_DAYS)).date().isoformat()
+        firestore = lazy_import("firebase_admin.firestore")
+        query = self._user_ref().collection("progress").where(
+            filter=firestore.FieldFilter("day", "<=", cutoff))
+        self._loaded_until = cutoff
+        data = {}
+        for shard in query.stream():
+            day = shard.id
+            for word, entry in shard.to_dict().get("words", {}).items():
+                if word in data:
+                    # 同一個字出現在兩個分片 (舊版寫入留下的)：保留 seen 較大的，另一份下次寫入時刪除
+                    if entry.get("seen", 0) <= data[word].get("seen", 0):
+                        self._stale.setdefault(word, []).append(day)
+                        continue
+                    self._stale.setdefault(word, []).append(self._bucket_of[word])
+                data[word] = entry
+                self._bucket_of[word] = day
+        return data, api_key, daily_queue
+
+    def _migrate(self, legacy):
+        """把單一文件的 learning_data 搬到分片並另存備份文件，確認分片完整後才標記 storage 並刪除舊欄位
+
+        中斷或確認失敗時主文件維持原狀，下次登入會重做 (sharded 保持 False，本次照舊用單一文件)。
+        """
+        firestore = lazy_import("firebase_admin.firestore")
+        ops = []
+        by_day, by_seen = {}, {}
+        for word, entry in legacy.items():
+            by_day.setdefault(self.day_of(entry), {})[word] = entry
+            by_seen.setdefault(self.seen_bucket(word), []).append(word)
+        now = time.time()
+        progress = self._user_ref().collection("progress")
+        seen = self._user_ref().collection("seen")
+        for day, words in by_day.items():
+            ops.append((progress.document(day), {"day": day, "words": words, "updated_at": now}))
+        for bucket, words in by_seen.items():
+            ops.append((seen.document(bucket), {"words": firestore.ArrayUnion(words)}))
+        if legacy:
+            ops.append((self._user_ref().collection("backup").document("learning_data"),
+                        {"learning_data": legacy, "migrated_at": now}))
+        self._commit(ops)
+        if not self._verify(legacy):
+            return
+        self._commit([(self._user_ref(), {"storage": self.VERSION, "learned_count": len(legacy),
+                                          "learning_data": firestore.DELETE_FIELD})])
+
+        self.sharded = True
+        self.learned_count = len(legacy)
+        for day, words in by_day.items():
+            for word in words:
+                self._bucket_of[word] = day
+        for bucket, words in by_seen.items():
+            self._seen[bucket] = set(words)
+
+    def _verify(self, legacy):
+        """分片中的每個單字都與 legacy 相同才算搬移完成"""
+        found = {}
+        for shard in self._user_ref().collection("progress").stream():
+            found.update(shard.to_dict().get("words", {}))
+        return all(found.get(word) == entry for word, entry in legacy.items())
+
+    def _commit(self, ops):
+        """以 set(merge=True) 分批寫入，每批不超過 Firestore 上限"""
+        for start in range(0, len(ops), Config.FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for ref, payload in ops[start:start + Config.FIRESTORE_BATCH_LIMIT]:
+                batch.set(ref, payload, merge=True)
+            batch.commit()
+
+    def is_seen(self, word):
+        """單字是否學過 (含尚未載入的分片)；需要時才讀取對應的 seen 桶"""
+        if word in self._bucket_of:
+            return True
+        bucket = self.seen_bucket(word)
+        with self._lock:
+            words = self._seen.get(bucket)
+        if words is None:
+            doc = self._user_ref().collection("seen").document(bucket).get()
+            words = set(doc.to_dict().get("words", [])) if doc.exists else set()
+            with self._lock:
+                self._seen[bucket] = words
+        return word in words
+
+    def _locate_unloaded(self, words):
+        """在 load 沒有讀取的分片中找出 words 所在的日期，回傳 {word: [日期...]}"""
+        query = self._user_ref().collection("progress")
+        if self._loaded_until is not None:
+            firestore = lazy_import("firebase_admin.firestore")
+            query = query.where(filter=firestore.FieldFilter("day", ">", self._loaded_until))
+        found = {}
+        for shard in query.stream():
+            for word in words & shard.to_dict().get("words", {}).keys():
+                found.setdefault(word, []).append(shard.id)
+        return found
+
+    @TRACER.trace("firestore.save_shards")
+    def save_changes(self, uid, changes):
+        """SyncBuffer 的 writer：把單字寫到新的日期分片，並從舊分片移除
+
+        學過但所在分片沒有載入的單字 (例如在別的裝置學過)，先查出舊分片再刪除，同一個字不會留在兩個分片。
+        """
+        firestore = lazy_import("firebase_admin.firestore")
+        now = time.time()
+        progress = self._user_ref().collection("progress")
+        ops, new_words, unloaded = [], [], set()
+        old_days = {}
+        for word in changes:
+            days = set(self._stale.get(word, ()))
+            if word in self._bucket_of:
+                days.add(self._bucket_of[word])
+            elif self.is_seen(word):
+                unloaded.add(word)
+            else:
+                new_words.append(word)
+            old_days[word] = days
+        if unloaded:
+            for word, days in self._locate_unloaded(unloaded).items():
+                old_days[word].update(days)
+        for word, data in changes.items():
+            day = self.day_of(data)
+            ops.append((progress.document(day), {"day": day, "words": {word: data}, "updated_at": now}))
+            for old_day in sorted(old_days[word] - {day}):
+                ops.append((progress.document(old_day), {"words": {word: firestore.DELETE_FIELD}}))
+        seen = self._user_ref().collection("seen")
+        for word in new_words:
+            ops.append((seen.document(self.seen_bucket(word)), {"words": firestore.ArrayUnion([word])}))
+        if new_words:
+            ops.append((self._user_ref(), {"learned_count": firestore.Increment(len(new_words))}))
+        self._commit(ops)
+
+        # 寫入成功後才更新本地狀態
+        with self._lock:
+            for word, data in changes.items():
+                self._bucket_of[word] = self.day_of(data)
+                self._stale.pop(word, None)
+            for word in new_words:
+                self._seen.setdefault(self.seen_bucket(word), set()).add(word)
+        self.learned_count += len(new_words)
+
+
+class SyncBuffer:
+    """Write-behind 緩衝：記錄變動的單字，於 Session 結束、定時或累積到上限時一次批次寫入
+
+    writer(uid, changes) 負責實際寫入 (通常是 FirebaseService.save_changes)。
+    寫入失敗時變動會放回緩衝區，但不會覆蓋期間又被更新過的單字，避免舊資料蓋掉新資料。
+    有待同步的變動時另有計時器在 flush_interval 後寫入，使用者關掉分頁 (不再重跑) 也不會遺失。
+    同一時間只有一個 flush (前景、背景或計時器) 在寫入：取出變動、writer 與日誌 ack 都在 _flush_lock 內，
+    較舊的變動不會在較新的之後才寫到雲端。
+    """
+
+    def __init__(self, writer, uid, flush_interval=None, max_dirty=None, journal=None):
+        self.writer = writer
+        self.uid = uid
+        self.flush_interval = Config.SYNC_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_dirty = Config.SYNC_FLUSH_MAX_DIRTY if max_dirty is None else max_dirty
+        self.journal = journal
+        self._dirty = journal.pending() if journal is not None else {}  # 上次尚未同步的評分
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._bg_thread = None
+        self._timer = None
+        if self._dirty:
+            with self._lock:
+                self._schedule()
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def mark_dirty(self, word, data):
+        with self._lock:
+            if self.journal is not None:
+                self.journal.append(word, data)  # 先寫本地日誌，雲端寫入失敗也不會遺失
+            self._dirty[word] = dict(data)
+            self._schedule()
+
+    def _schedule(self):
+        """確保有一個計時器會寫入目前的變動 (呼叫端需持有 lock)"""
+        if self._timer is None and self.flush_interval > 0:
+            self._timer = threading.Timer(self.flush_interval, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        if not self.flush():
+            with self._lock:
+                self._schedule()  # 寫入失敗，稍後再試
+
+    def should_flush(self):
+        if not self._dirty: return False
+        return (len(self._dirty) >= self.max_dirty or
+                time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def maybe_flush(self, background=False):
+        if not self.should_flush(): return True
+        if background:
+            self.flush_in_background()
+            return True
+        return self.flush()
+
+    def flush(self):
+        """寫入所有待同步的變動，成功回傳 True；其他 flush 進行中時等它寫完"""
+        with self._flush_lock:
+            with self._lock:
+                changes, self._dirty = self._dirty, {}
+                seq = self.journal.seq if self.journal is not None else 0
+            if not changes:
+                return True
+            try:
+                self.writer(self.uid, changes)
+            except Exception:
+                with self._lock:
+                    for word, data in changes.items():
+                        self._dirty.setdefault(word, data)
+                return False
+            self._last_flush = time.monotonic()
+            if self.journal is not None:
+                self.journal.ack(seq, changes)
+            return True
+
+    def flush_in_background(self):
+        """在背景執行緒寫入 (已有背景寫入進行中就略過)，評分不必等待網路"""
+        with self._lock:
+            if self._bg_thread is not None and self._bg_thread.is_alive():
+                return self._bg_thread
+            thread = self._bg_thread = threading.Thread(target=self.flush, daemon=True)
+        thread.start()
+        return thread
+
+
+class ReviewJournal:
+    """本地的評分日誌 (append-only)，讓評分只需等待本地磁碟、雲端暫時無法連線也不會遺失
+
+    每位使用者一個目錄 {JOURNAL_DIR}/{uid}/：
+    - {HISTORY_FILE}: 快照 {"seq", "pending": {word: [seq, data]}}，只保留尚未同步到雲端的紀錄
+    - {HISTORY_FILE}.log: 快照之後的事件，每行一筆評分 {"seq", "word", "data"}
+      或同步確認 {"ack": seq, "words": [...]} (雲端已有這些單字 seq 以前的資料)
+    建立時重播快照與日誌，並立即壓縮；之後日誌累積到 JOURNAL_COMPACT_EVERY 行時再壓縮。
+    """
+
+    def __init__(self, uid, directory=None, fsync=None):
+        self.directory = os.path.join(directory or Config.JOURNAL_DIR, uid)
+        self.snapshot_path = os.path.join(self.directory, Config.HISTORY_FILE)
+        self.log_path = self.snapshot_path + ".log"
+        self.fsync = Config.JOURNAL_FSYNC if fsync is None else fsync
+        self.seq = 0
+        self._pending = {}   # word -> (seq, data)
+        self._log_lines = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._replay()
+            self._compact()  # 順便清掉中斷時寫壞的最後一行
+
+    def _replay(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.seq = snapshot.get("seq", 0)
+            self._pending = {w: (s, d) for w, (s, d) in snapshot.get("pending", {}).items()}
+        except (OSError, ValueError):
+            pass
+        snapshot_seq = self.seq
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "ack" in event:
+                        self._apply_ack(event["ack"], event["words"])
+                    elif event["seq"] > snapshot_seq:  # 壓縮後、清空日誌前中斷時會有重複的事件
+                        self._pending[event["word"]] = (event["seq"], event["data"])
+                        self.seq = max(self.seq, event["seq"])
+        except OSError:
+            pass
+
+    def _apply_ack(self, seq, words):
+        for word in words:
+            entry = self._pending.get(word)
+            if entry is not None and entry[0] <= seq:
+                del self._pending[word]
+
+    def _write(self, event):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            f.flush()
+            if self.fsync: os.fsync(f.fileno())
+        self._log_lines += 1
+
+    @TRACER.trace("journal.append")
+    def append(self, word, data):
+        with self._lock:
+            self.seq += 1
+            data = dict(data)
+            self._write({"seq": self.seq, "word": word, "data": data})
+            self._pending[word] = (self.seq, data)
+            return self.seq
+
+    def ack(self, seq, words):
+        """words 已寫入雲端 (到 seq 為止的版本)；之後又有新評分的單字仍保留"""
+        with self._lock:
+            words = list(words)
+            self._apply_ack(seq, words)
+            self._write({"ack": seq, "words": words})
+            if self._log_lines >= Config.JOURNAL_COMPACT_EVERY:
+                self._compact()
+
+    def _compact(self):
+        """把目前狀態寫成新快照 (先寫暫存檔再 rename)，然後清空日誌"""
+        snapshot = {"seq": self.seq, "pending": {w: [s, d] for w, (s, d) in self._pending.items()}}
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+            f.flush()
+            if self.fsync: os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        open(self.log_path, "w").close()
+        self._log_lines = 0
+
+    def reconcile(self, cloud):
+        """登入時與雲端資料比對，回傳比雲端新的待同步紀錄 {word: data}
+
+        以 seen (評分次數，每次評分加一) 當作版本：雲端的 seen 不小於日誌中的，表示雲端已有同一次
+        (ack 寫入前中斷) 或更新的評分 (例如這份日誌離線期間在其他伺服器或裝置上評過分)，
+        這些紀錄視為已同步並移除，不會蓋掉雲端、也不會再被寫回去。
+        雲端沒有的單字 (分片模式下可能只是沒有載入) 無從比較，照舊保留。
+        """
+        with self._lock:
+            entries = list(self._pending.items())
+        fresh, stale, stale_seq = {}, [], 0
+        for word, (seq, data) in entries:
+            current = cloud.get(word)
+            if current is not None and current.get("seen", 0) >= data.get("seen", 0):
+                stale.append(word)
+                stale_seq = max(stale_seq, seq)
+            else:
+                fresh[word] = dict(data)
+        if stale:
+            self.ack(stale_seq, stale)
+        return fresh
+
+    def pending(self):
+        """尚未同步到雲端的紀錄 {word: data}"""
+        with self._lock:
+            return {w: dict(d) for w, (_, d) in self._pending.items()}
+
+    def __len__(self):
+        return len(self._pending)
+
+
+@st.cache_resource
+def get_review_journal(uid):
+    """同一使用者在同一台伺服器的多個分頁共用一份日誌"""
+    return ReviewJournal(uid)
+
+
 class AIService:
     @staticmethod
     def fetch_dictionary(word):
         api_key = st.session_state.get("gemini_key")
+
+        # 呼叫全域快取函式 (字典檔與共用快取不需 API Key)
+        result = fetch_ai_definition(word, api_key)
+        if result:
+            return result
         if not api_key:
             return {
                 "phonetic": "/.../",
                 "definition": "請先設定 API Key",
                 "example": "Please set API Key first."
             }
+        return {"phonetic": "/?/", "definition": "AI 連線錯誤", "example": "Error"}
 
-        # 呼叫全域快取函式
-        result = fetch_ai_definition(word, api_key)
-        if result:
-            return result
-        else:
-            return {"phonetic": "/?/", "definition": "AI 連線錯誤", "example": "Error"}
+    @staticmethod
+    def prefetch_dictionary(words):
+        """一次解析整批單字，結果放進 session_state.prefetched_dict"""
+        api_key = st.session_state.get("gemini_key")
+        st.session_state.prefetched_dict = fetch_ai_definitions(words, api_key)
 
     @staticmethod
+    @TRACER.trace("tts.play_audio")
     def play_audio(text):
-        # gTTS 本身較慢，且 Streamlit 重繪會中斷，這是目前架構的限制
-        # 若要優化需改用前端 JavaScript TTS，但代碼複雜度會大增。
+        # 先查磁碟快取，只有第一次才呼叫 gTTS；重繪時直接送出快取的 bytes
         try:
-            tts = gTTS(text=text, lang='en')
-            fp = io.BytesIO()
-            tts.write_to_fp(fp)
-            st.audio(fp, format='audio/mp3')
+            st.audio(get_audio_cache().get_or_synthesize(text, 'en'), format='audio/mp3')
         except:
             st.warning("語音暫時無法播放")
 
+    @staticmethod
+    def prefetch_audio(words):
+        """在背景預先合成本次單字的語音"""
+        get_audio_cache().warm_in_background(words)
+
+    @staticmethod
+    def _generate_text(prompt, render):
+        """呼叫模型產生文字；串流模式下每收到一段就呼叫 render(目前全文)，回傳完整文字"""
+        api_key = st.session_state.get("gemini_key")
+        # 串流期間一直借用 client，避免被其他 Key 擠出 LRU 時中途關閉
+        with get_gemini_registry().lease(api_key) as model:
+            if not Config.STREAM_GENERATION:
+                text = call_gemini(api_key, lambda: model.generate_content(prompt)).text
+                render(text)
+                return text
+
+            text = ""
+            for chunk in call_gemini(api_key, lambda: model.generate_content(prompt, stream=True)):
+                try:
+                    piece = chunk.text
+                except ValueError:
+                    continue  # 沒有文字內容的片段 (例如只有安全性資訊)
+                text += piece
+                render(text)
+            return text
+
     @staticmethod
     def generate_mnemonic(word):
         api_key = st.session_state.get("gemini_key")
@@ -259,15 +1925,27 @@ class AIService:
         theme_config = st.session_state.get("theme_config", ("職場生活", "辦公室趣事"))
         theme_str = f"{theme_config[0]} - {theme_config[1]}"
 
-        with st.spinner("🧠 AI 腦力激盪中..."):
-            try:
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(Config.MODEL_NAME)
-                prompt = Config.PROMPTS["mnemonic"].format(word=word, theme=theme_str)
-                res = model.generate_content(prompt)
-                st.info(f"💡 **記憶小撇步**：\n\n{res.text}")
-            except Exception as e:
-                st.error(f"AI 呼叫失敗: {e}")
+        cache = get_generation_cache()
+        key = GenerationCache.mnemonic_key(word, theme_str)
+        cached = cache.get(key)
+        if cached is not None:
+            st.info(f"💡 **記憶小撇步**：\n\n{cached}")
+            return
+
+        placeholder = st.empty()
+        placeholder.info("🧠 AI 腦力激盪中...")
+        try:
+            prompt = Config.PROMPTS["mnemonic"].format(word=word, theme=theme_str)
+            text = AIService._generate_text(
+                prompt, lambda t: placeholder.info(f"💡 **記憶小撇步**：\n\n{t}"))
+            cache.put(key, text)
+        except Exception as e:
+            placeholder.error(f"AI 呼叫失敗: {e}")
+
+    @staticmethod
+    def cached_story(theme, sub_theme, words):
+        """已生成過的故事 (回到完成畫面時直接顯示)，沒有則回傳 None"""
+        return get_generation_cache().get(GenerationCache.story_key(theme, sub_theme, words))
 
     @staticmethod
     def generate_story(theme, sub_theme, words):
@@ -277,24 +1955,504 @@ class AIService:
         theme_str = f"{theme} - {sub_theme}"
         words_str = ", ".join(words)
 
-        with st.spinner("📖 AI 正在編織故事..."):
+        cache = get_generation_cache()
+        key = GenerationCache.story_key(theme, sub_theme, words)
+        st.markdown("### 📖 您的客製化故事")
+        cached = cache.get(key)
+        if cached is not None:
+            st.markdown(cached)
+            return
+
+        placeholder = st.empty()
+        placeholder.caption("📖 AI 正在編織故事...")
+        try:
+            prompt = Config.PROMPTS["story"].format(theme=theme_str, words=words_str)
+            text = AIService._generate_text(prompt, placeholder.markdown)
+            cache.put(key, text)
+        except Exception as e:
+            placeholder.error(f"生成失敗: {e}")
+
+
+class BatchPipeline:
+    """預先準備下一批單字 (每個 session 一個，存在 session_state)
+
+    下一批就是 DailyQueue 前端的下一段 (peek 只需 O(batch))，字典與語音在背景寫入持久化快取，
+    下一輪 start_session 取用時都會命中快取。評分可能改變佇列前端 (答錯的字重新排入)，
+    這時重新準備；重疊的單字已在快取中，只有新出現的會真的去查詢。
+    """
+
+    def __init__(self):
+        self.words = None
+        self._futures = []
+
+    def stage(self, queue, index, api_key=None):
+        """準備佇列的下一段並開始背景預熱"""
+        self.invalidate()
+        words = self.words = queue.peek(index)
+        if words:
+            AIService.prefetch_audio(words)
+            if api_key:
+                # 每個單字各自一個工作：不佔著執行緒等待其他查詢，也能個別取消
+                _prime_dictionary_resources()
+                key = _dictionary_cache_key(api_key)
+                pool = get_pipeline_executor()
+                self._futures = [pool.submit(_resolve_definition, word, api_key, key) for word in words]
+        return words
+
+    def on_review(self, queue, index):
+        """評分後檢查準備好的批次是否仍是佇列的下一段，需要重新準備時回傳 False"""
+        return self.words is None or self.words == queue.peek(index)
+
+    def take(self, queue, index):
+        """開始新的一輪：準備好的批次仍是佇列的下一段 (已預熱) 時回傳 True"""
+        words, self.words, self._futures = self.words, None, []
+        return bool(words) and words == queue.peek(index)
+
+    def invalidate(self):
+        for future in self._futures:
+            future.cancel()  # 還沒開始的預熱不必執行
+        self.words, self._futures = None, []
+
+
+@st.cache_resource
+def get_pipeline_executor():
+    return ThreadPoolExecutor(max_workers=Config.PIPELINE_WORKERS, thread_name_prefix="next-batch")
+
+
+class CoalescingWriter:
+    """以 key 合併背景寫入：同一個 key 同時只有一個寫入在進行，排隊期間只保留最新的一筆
+
+    寫入整份文件 (例如每日佇列) 時，中間的版本會被下一筆蓋掉，不必逐筆寫出；
+    不同 key 在共用的執行緒池中並行，某位使用者的寫入變慢也不會擋住其他人。
+    寫入失敗直接略過 (呼叫端的資料下次寫入時會再送出)。
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._pending = {}    # key -> (fn, args)，最新一筆尚未寫出的
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        with self._lock:
+            self._pending[key] = (fn, args)
+            if key in self._running:
+                return  # 進行中的寫入完成後會接著寫出這一筆
+            self._running.add(key)
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                item = self._pending.pop(key, None)
+                if item is None:
+                    self._running.discard(key)
+                    return
+            fn, args = item
             try:
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(Config.MODEL_NAME)
-                prompt = Config.PROMPTS["story"].format(theme=theme_str, words=words_str)
-                response = model.generate_content(prompt)
-                st.markdown("### 📖 您的客製化故事")
-                st.markdown(response.text)
-            except Exception as e:
-                st.error(f"生成失敗: {e}")
+                fn(*args)
+            except Exception:
+                pass
+
+
+@st.cache_resource
+def get_persist_executor():
+    # 寫回 Firestore 用的獨立執行緒池：不佔預熱的名額；同一份文件的寫入由 CoalescingWriter 依序完成
+    return ThreadPoolExecutor(max_workers=Config.PERSIST_WORKERS, thread_name_prefix="persist")
+
+
+@st.cache_resource
+def get_daily_queue_writer():
+    return CoalescingWriter(get_persist_executor())
 
 
 # =================================================================
-# MODULE 4: 商業邏輯 (SRS Engine) - 保持原樣，邏輯無問題
+# MODULE 4: 商業邏輯 (SRS Engine：複習索引、排程與每日佇列)
 # =================================================================
+class ReviewIndex:
+    """維護中的複習索引：以數值 next_review 為鍵的 min-heap + 直接在共用 WordList 上抽樣的新字
+
+    由 SRSEngine.calculate_next_review 增量更新，抽詞時不必再掃描全部歷史與單字表。
+    新字以隨機位置抽樣、略過學過的單字 (每次期望 O(1))，不必為每個 session 複製一份未學單字池。
+    """
+
+    MAX_MISSES = 32  # 抽樣連續落在學過的單字超過此數 (單字表快學完) 時，改為掃描一次單字表
+
+    def __init__(self, history, full_list):
+        self._due = {}   # word -> next_review timestamp (以此為準，heap 中過期的項目延遲清除)
+        self._heap = []
+        for word, data in history.items():
+            ts = self.to_timestamp(data.get("next_review", ""))
+            self._due[word] = ts
+            self._heap.append((ts, word))
+        heapq.heapify(self._heap)
+
+        # App 傳入共用的 WordList；其他呼叫端 (例如基準測試) 傳 list 時才另外建立
+        self._words = full_list if isinstance(full_list, WordList) else WordList(full_list)
+        self._seen_elsewhere = set()  # is_seen 確認學過、但不在 history 中的單字
+        self._known = sum(1 for w in self._due if w in self._words)  # 單字表中有紀錄的單字數
+
+    @staticmethod
+    def to_timestamp(iso):
+        """ISO 字串轉 epoch 秒；缺值視為立即到期 (與原本字串比較的行為一致)"""
+        if not iso: return 0.0
+        try:
+            return datetime.fromisoformat(iso).timestamp()
+        except ValueError:
+            return 0.0
+
+    def update(self, word, data):
+        ts = self.to_timestamp(data.get("next_review", ""))
+        if word not in self._due and word in self._words:
+            self._seen_elsewhere.discard(word)
+            self._known += 1
+        self._due[word] = ts
+        heapq.heappush(self._heap, (ts, word))
+        # 延遲刪除的舊項目太多時重建 heap
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(t, w) for w, t in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _is_unseen(self, word):
+        return word not in self._due and word not in self._seen_elsewhere
+
+    def due_at(self, word):
+        """單字的 next_review timestamp (沒有紀錄回傳 None)"""
+        return self._due.get(word)
+
+    def due_words(self, now_ts, limit):
+        """取出最多 limit 個已到期單字 (最久未複習者優先)，不改變索引內容"""
+        taken, seen = [], set()
+        while self._heap and len(taken) < limit and self._heap[0][0] < now_ts:
+            ts, word = heapq.heappop(self._heap)
+            if self._due.get(word) != ts or word in seen:
+                continue
+            seen.add(word)
+            taken.append((ts, word))
+        for item in taken:
+            heapq.heappush(self._heap, item)
+        return [w for _, w in taken]
+
+    def sample_unseen(self, k, is_seen=None):
+        """隨機抽 k 個未學單字；is_seen 可檢查未載入的紀錄，學過的會記下來之後不再抽到"""
+        words = self._words.words
+        picked, chosen, misses = [], set(), 0
+        while len(picked) < k and self._unseen_count() > 0:
+            if misses > self.MAX_MISSES:
+                return picked + self._scan_unseen(k - len(picked), is_seen, chosen)
+            word = words[random.randrange(len(words))]
+            if word in chosen or not self._is_unseen(word):
+                misses += 1
+            elif is_seen is not None and is_seen(word):
+                self._seen_elsewhere.add(word)
+            else:
+                picked.append(word)
+                chosen.add(word)
+        return picked
+
+    def _scan_unseen(self, k, is_seen, chosen):
+        """單字表快學完時：一次列出剩下的未學單字再隨機選 (O(N)，不會無限重抽)"""
+        pool = [w for w in self._words.words if w not in chosen and self._is_unseen(w)]
+        random.shuffle(pool)
+        picked = []
+        for word in pool:
+            if len(picked) >= k:
+                break
+            if is_seen is not None and is_seen(word):
+                self._seen_elsewhere.add(word)
+            else:
+                picked.append(word)
+        return picked
+
+    def _unseen_count(self):
+        return len(self._words) - self._known - len(self._seen_elsewhere)
+
+
+class ReviewAnalytics:
+    """學習紀錄的統計：未來每日到期數、熟練度分佈、估計記憶保留率與每日複習量
+
+    next_review / interval / mastery 存成 NumPy 陣列 (一個單字一列)，登入時一次向量化轉換，
+    之後由 process_review 呼叫 update 增量維護；到期日與熟練度的計數也隨之增減，
+    重跑時繪製側邊欄不必再走訪 learning_data 或解析 ISO 字串。
+    """
+
+    NAT = -(1 << 63)  # np.iinfo(np.int64).min：沒有 next_review (視為立即到期)
+
+    def __init__(self, history):
+        np = lazy_import("numpy")
+        words = list(history.keys())
+        entries = [history[w] for w in words]
+        self._row = {w: i for i, w in enumerate(words)}
+        self._size = len(words)
+        capacity = max(self._size, 64)
+        self._next = np.full(capacity, self.NAT, dtype=np.int64)  # 本地時間 epoch 秒
+        self._interval = np.zeros(capacity, dtype=np.int32)
+        self._mastery = np.zeros(capacity, dtype=np.int32)
+        if entries:
+            self._next[:self._size] = self._parse_times([e.get("next_review", "") for e in entries])
+            self._interval[:self._size] = [e.get("interval", 0) for e in entries]
+            self._mastery[:self._size] = [e.get("mastery", 0) for e in entries]
+
+        days, counts = np.unique(self._day(self._next[:self._size]), return_counts=True)
+        self._by_day = dict(zip(days.tolist(), counts.tolist()))
+        levels, counts = np.unique(self._mastery[:self._size], return_counts=True)
+        self._by_mastery = dict(zip(levels.tolist(), counts.tolist()))
+        self._retention = None  # (計算時間, 結果)
+
+    @classmethod
+    def _parse_times(cls, isos):
+        """ISO 字串陣列轉 epoch 秒 (本地時間，不做時區換算)；無法解析的視為立即到期"""
+        np = lazy_import("numpy")
+        try:
+            times = np.array([s or "NaT" for s in isos], dtype="datetime64[us]")
+        except ValueError:
+            times = np.array([cls._parse_one(s) for s in isos], dtype="datetime64[us]")
+        return times.astype("datetime64[s]").astype(np.int64)
+
+    @staticmethod
+    def _parse_one(iso):
+        np = lazy_import("numpy")
+        try:
+            return np.datetime64(iso or "NaT", "us")
+        except ValueError:
+            return np.datetime64("NaT", "us")
+
+    @classmethod
+    def _day(cls, seconds):
+        """epoch 秒轉日期序號；沒有 next_review 的歸到最早的一天"""
+        np = lazy_import("numpy")
+        return np.where(seconds == cls.NAT, cls.NAT, seconds // 86400)
+
+    @staticmethod
+    def _now():
+        np = lazy_import("numpy")
+        return int(np.datetime64(datetime.now(), "s").astype(np.int64))
+
+    @staticmethod
+    def _bump(counter, key, delta):
+        count = counter.get(key, 0) + delta
+        if count: counter[key] = count
+        else: counter.pop(key, None)
+
+    def update(self, word, data):
+        """單字評分後更新對應的列與計數 (O(1)，陣列滿時加倍)"""
+        np = lazy_import("numpy")
+        row = self._row.get(word)
+        if row is None:
+            if self._size == len(self._next):
+                grow = len(self._next)
+                self._next = np.concatenate([self._next, np.full(grow, self.NAT, dtype=np.int64)])
+                self._interval = np.concatenate([self._interval, np.zeros(grow, dtype=np.int32)])
+                self._mastery = np.concatenate([self._mastery, np.zeros(grow, dtype=np.int32)])
+            row = self._row[word] = self._size
+            self._size += 1
+        else:
+            self._bump(self._by_day, int(self._day(self._next[row])), -1)
+            self._bump(self._by_mastery, int(self._mastery[row]), -1)
+
+        self._next[row] = self._parse_times([data.get("next_review", "")])[0]
+        self._interval[row] = data.get("interval", 0)
+        self._mastery[row] = data.get("mastery", 0)
+        self._bump(self._by_day, int(self._day(self._next[row])), 1)
+        self._bump(self._by_mastery, int(self._mastery[row]), 1)
+        self._retention = None
+
+    def __len__(self):
+        return self._size
+
+    def forecast(self, days=None):
+        """未來每天到期的單字數；第 0 天包含所有已逾期的單字"""
+        np = lazy_import("numpy")
+        days = days or Config.ANALYTICS_FORECAST_DAYS
+        today = self._now() // 86400
+        counts = np.zeros(days, dtype=np.int64)
+        for day, count in self._by_day.items():
+            offset = day - today
+            if offset < days:
+                counts[max(offset, 0)] += count
+        return counts
+
+    def mastery_distribution(self):
+        """{mastery: 單字數}，依熟練度排序"""
+        return dict(sorted(self._by_mastery.items()))
+
+    def retention(self):
+        """估計目前的平均記憶保留率 R = exp(-t / interval)，t 為距上次複習的天數
+
+        上次複習時間由 next_review - interval 推得；答錯 (mastery 0) 的單字 next_review 即為複習當下。
+        """
+        np = lazy_import("numpy")
+        now = self._now()
+        cached = self._retention
+        if cached is not None and now - cached[0] < Config.ANALYTICS_RETENTION_TTL:
+            return cached[1]
+        n = self._size
+        next_ts, interval, mastery = self._next[:n], self._interval[:n], self._mastery[:n]
+        known = next_ts != self.NAT
+        stability = np.maximum(interval[known], 1).astype(np.float64)
+        last = next_ts[known] - np.where(mastery[known] > 0, interval[known].astype(np.int64) * 86400, 0)
+        elapsed = np.clip((now - last) / 86400.0, 0.0, None)
+        values = np.exp(-elapsed / stability)
+        result = {"mean": float(values.mean()) if values.size else None,
+                  "below_half": int((values < 0.5).sum())}
+        self._retention = (now, result)
+        return result
+
+    def workload(self, days=7):
+        """今天要複習的數量 (含逾期) 與未來 days 天的平均每日複習量"""
+        counts = self.forecast(max(days, 1) + 1)
+        return {"today": int(counts[0]), "daily_avg": float(counts[1:days + 1].mean())}
+
+
+class CompactLearningStore:
+    """以 NumPy structured array 儲存的 learning_data (只存學過的單字，每個 22 bytes)
+
+    學過的單字依單字表編號排序存在 _ids (u32)，欄位存在平行的 _rows；查詢用二分搜尋，
+    新單字插入到排序位置 (陣列依需要成長)，記憶體只與學過的單字數成正比、不隨單字表變大。
+    對外提供與 dict 相同的讀寫介面 (get / [] / in / items ...)，讀取時回傳新的 dict，
+    因此 SRSEngine 與 VocabularyApp.process_review 不需修改。不在單字表中的單字或
+    含額外欄位的紀錄會存放在 _extra。
+    """
+
+    _DTYPE = None  # NumPy structured dtype，第一次用到時才建立 (載入模組時不必 import numpy)
+    FIELDS = {"mastery", "seen", "interval", "next_review"}
+    MAGIC = b"VOCABLD2"
+
+    def __init__(self, word_list):
+        np = lazy_import("numpy")
+        self._word_ids = word_list.index  # 共用 WordList 的對照表，不複製
+        self._words = word_list.words     # id -> word
+        self._ids = np.empty(0, dtype="<u4")
+        self._rows = np.empty(0, dtype=self.dtype())
+        self._extra = {}
+
+    @classmethod
+    def dtype(cls):
+        if cls._DTYPE is None:
+            cls._DTYPE = lazy_import("numpy").dtype(
+                [("mastery", "<i2"), ("seen", "<i4"), ("interval", "<i4"), ("next_review", "<f8")])
+        return cls._DTYPE
+
+    @classmethod
+    def from_dict(cls, data, word_list):
+        """一次建好排序後的陣列 (逐筆插入是 O(n²))"""
+        np = lazy_import("numpy")
+        store = cls(word_list)
+        ids, rows = [], []
+        for word, entry in data.items():
+            i = word_list.index.get(word)
+            if i is None or not set(entry) <= cls.FIELDS:
+                store._extra[word] = dict(entry)
+            else:
+                ids.append(i)
+                rows.append(cls._dict_to_row(entry))
+        order = np.argsort(np.array(ids, dtype="<u4"), kind="stable")
+        store._ids = np.array(ids, dtype="<u4")[order]
+        store._rows = np.array(rows, dtype=cls.dtype())[order] if rows else store._rows
+        return store
+
+    def _find(self, word):
+        """回傳 (單字編號, 在 _ids 中的位置, 是否已有紀錄)；不在單字表中時編號為 None"""
+        np = lazy_import("numpy")
+        i = self._word_ids.get(word)
+        if i is None:
+            return None, 0, False
+        pos = int(np.searchsorted(self._ids, i))
+        return i, pos, pos < len(self._ids) and self._ids[pos] == i
+
+    def __len__(self):
+        return len(self._ids) + len(self._extra)
+
+    def __contains__(self, word):
+        return word in self._extra or self._find(word)[2]
+
+    def __getitem__(self, word):
+        entry = self.get(word)
+        if entry is None: raise KeyError(word)
+        return entry
+
+    def get(self, word, default=None):
+        if word in self._extra:
+            return dict(self._extra[word])
+        _, pos, found = self._find(word)
+        if not found:
+            return default
+        return self._row_to_dict(self._rows[pos])
+
+    @staticmethod
+    def _row_to_dict(row):
+        np = lazy_import("numpy")
+        entry = {"mastery": int(row["mastery"]), "seen": int(row["seen"]), "interval": int(row["interval"])}
+        if not np.isnan(row["next_review"]):
+            entry["next_review"] = datetime.fromtimestamp(float(row["next_review"])).isoformat()
+        return entry
+
+    @staticmethod
+    def _dict_to_row(entry):
+        np = lazy_import("numpy")
+        return (entry.get("mastery", 0), entry.get("seen", 0), entry.get("interval", 0),
+                ReviewIndex.to_timestamp(entry["next_review"]) if "next_review" in entry else np.nan)
+
+    def __setitem__(self, word, entry):
+        np = lazy_import("numpy")
+        i, pos, found = self._find(word)
+        if i is None or not set(entry) <= self.FIELDS:
+            self._extra[word] = dict(entry)
+            if found:
+                self._ids = np.delete(self._ids, pos)
+                self._rows = np.delete(self._rows, pos)
+            return
+        self._extra.pop(word, None)
+        row = np.array(self._dict_to_row(entry), dtype=self.dtype())
+        if found:
+            self._rows[pos] = row
+        else:
+            self._ids = np.insert(self._ids, pos, i)
+            self._rows = np.insert(self._rows, pos, row)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [self._words[i] for i in self._ids] + list(self._extra)
+
+    def items(self):
+        for i, row in zip(self._ids, self._rows):
+            yield self._words[i], self._row_to_dict(row)
+        for word, entry in self._extra.items():
+            yield word, dict(entry)
+
+    def to_dict(self):
+        """轉回原本的 {word: {...}} 格式 (寫入 Firestore 用)"""
+        return dict(self.items())
+
+    def to_bytes(self):
+        """精簡二進位格式：u32 id 陣列 + 欄位陣列，額外紀錄以 JSON 附加"""
+        extra = json.dumps(self._extra, ensure_ascii=False).encode("utf-8")
+        header = self.MAGIC + struct.pack("<III", len(self._word_ids), len(self._ids), len(extra))
+        return header + self._ids.tobytes() + self._rows.tobytes() + extra
+
+    @classmethod
+    def from_bytes(cls, blob, word_list):
+        np = lazy_import("numpy")
+        if blob[:8] != cls.MAGIC:
+            raise ValueError("不是有效的 learning_data 二進位資料")
+        vocab_size, n, extra_len = struct.unpack_from("<III", blob, 8)
+        if vocab_size != len(word_list):
+            raise ValueError("單字表已變更，無法還原編號")
+        pos = 8 + 12
+        store = cls(word_list)
+        store._ids = np.frombuffer(blob, dtype="<u4", count=n, offset=pos).copy()
+        pos += store._ids.nbytes
+        store._rows = np.frombuffer(blob, dtype=cls.dtype(), count=n, offset=pos).copy()
+        pos += store._rows.nbytes
+        store._extra = json.loads(blob[pos:pos + extra_len].decode("utf-8"))
+        return store
+
+
 class SRSEngine:
     @staticmethod
-    def calculate_next_review(current_data, quality):
+    def calculate_next_review(current_data, quality, word=None, index=None):
         if "mastery" not in current_data: current_data.update({"mastery": 0, "seen": 0, "interval": 0})
         data = current_data.copy()
         data["seen"] = data.get("seen", 0) + 1
@@ -310,24 +2468,127 @@ class SRSEngine:
             data["interval"] = max(1, int(data["interval"] * multiplier))
             data["mastery"] += 1
             data["next_review"] = (now + timedelta(days=data["interval"])).isoformat()
+
+        # 增量更新複習索引
+        if index is not None and word is not None:
+            index.update(word, data)
         return data
 
     @staticmethod
-    def get_review_batch(history, full_list, batch_size=5):
-        now = datetime.now().isoformat()
-        review_list = [w for w, d in history.items() if d.get("next_review", "") < now]
-        new_list = [w for w in full_list if w not in history]
+    def review_quota(batch_size):
+        """一批中最多放幾個複習字，其餘為新字"""
+        return min(batch_size, Config.REVIEW_QUOTA)
+
+    @staticmethod
+    def get_review_batch(history, full_list, batch_size=None, index=None, is_seen=None):
+        # 沒有現成索引時臨時建立一個 (O(N))；App 會在登入時建好並持續維護
+        if index is None:
+            index = ReviewIndex(history, full_list)
 
-        selected = []
-        if review_list:
-            selected.extend(random.sample(review_list, min(len(review_list), 3)))
+        batch_size = batch_size or Config.SESSION_SIZE
+        selected = index.due_words(time.time(), SRSEngine.review_quota(batch_size))
         needed = batch_size - len(selected)
-        if needed > 0 and new_list:
-            selected.extend(random.sample(new_list, min(len(new_list), needed)))
+        if needed > 0:
+            selected.extend(index.sample_unseen(needed, is_seen))
         random.shuffle(selected)
         return selected
 
 
+class DailyQueue:
+    """每位使用者每天一份的學習佇列 (存在 session_state 與 users/{uid}.daily_queue)
+
+    當天第一輪時一次選好：今天結束前到期的複習字 (最久未複習者優先，最多 DAILY_REVIEW_LIMIT 個)
+    與隨機的新字 (最多 DAILY_NEW_LIMIT 個)。之後每輪只從兩個清單的前端切出一批 (O(batch))，
+    重新整理或換裝置時沿用同一份，每日上限不會因為多開幾輪而被突破。
+    清單中已失效的單字 (在別處已複習、新字已學過) 取用時直接略過，所以寫入雲端失敗也不會重複出題。
+    分片儲存時 is_seen 為 ShardedProgress.is_seen，紀錄不在已載入分片中的新字也能判定為已學過。
+    """
+
+    def __init__(self, day, reviews, new, is_seen=None):
+        self.day = day
+        self.reviews = list(reviews)
+        self.new = list(new)
+        self.is_seen = is_seen
+        self._cutoff = (datetime.fromisoformat(day) + timedelta(days=1)).timestamp()
+
+    @staticmethod
+    def today():
+        return datetime.now().date().isoformat()
+
+    @classmethod
+    @TRACER.trace("srs.build_daily_queue")
+    def build(cls, index, is_seen=None):
+        queue = cls(cls.today(), [], [], is_seen)
+        queue.reviews = index.due_words(queue._cutoff, Config.DAILY_REVIEW_LIMIT)
+        queue.new = index.sample_unseen(Config.DAILY_NEW_LIMIT, is_seen)
+        return queue
+
+    @classmethod
+    def from_dict(cls, data, is_seen=None):
+        """雲端存的佇列；格式不對回傳 None (重新建立)"""
+        try:
+            return cls(data["day"], data.get("reviews", []), data.get("new", []), is_seen)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def to_dict(self):
+        # 複製一份：背景寫入時 session 仍會繼續取用 / 重建佇列
+        return {"day": self.day, "reviews": list(self.reviews), "new": list(self.new)}
+
+    def _is_due(self, index):
+        def valid(word):
+            ts = index.due_at(word)
+            return ts is not None and ts < self._cutoff
+        return valid
+
+    def _is_new(self, index):
+        is_seen = self.is_seen
+        if is_seen is None:
+            return lambda word: index.due_at(word) is None
+        return lambda word: index.due_at(word) is None and not is_seen(word)
+
+    @staticmethod
+    def _scan(items, valid, k):
+        """從前端取最多 k 個仍有效的單字，回傳 (單字, 掃過的長度)"""
+        taken, pos = [], 0
+        while pos < len(items) and len(taken) < k:
+            if valid(items[pos]): taken.append(items[pos])
+            pos += 1
+        return taken, pos
+
+    def _slice(self, index, size):
+        """下一批的 (複習字數, 新字數)：複習字最多 review_quota 個，新字不夠時以複習字補滿"""
+        reviews, _ = self._scan(self.reviews, self._is_due(index), size)
+        new, _ = self._scan(self.new, self._is_new(index), size)
+        n_review = min(SRSEngine.review_quota(size), len(reviews))
+        n_new = min(size - n_review, len(new))
+        return min(size - n_new, len(reviews)), n_new
+
+    def peek(self, index, size=None):
+        """下一批的單字 (不取出)"""
+        n_review, n_new = self._slice(index, size or Config.SESSION_SIZE)
+        return self._scan(self.reviews, self._is_due(index), n_review)[0] + \
+            self._scan(self.new, self._is_new(index), n_new)[0]
+
+    def take(self, index, size=None):
+        """取出下一批 (順序與 peek 相同)，連同前面已失效的單字一起移除"""
+        n_review, n_new = self._slice(index, size or Config.SESSION_SIZE)
+        reviews, review_end = self._scan(self.reviews, self._is_due(index), n_review)
+        new, new_end = self._scan(self.new, self._is_new(index), n_new)
+        del self.reviews[:review_end]
+        del self.new[:new_end]
+        return reviews + new
+
+    def requeue(self, word):
+        """答錯的字今天再複習一次 (排在今天的複習字最後)"""
+        if word not in self.reviews:
+            self.reviews.append(word)
+
+    def remaining(self):
+        """今天還剩下的 (複習字, 新字) 數 (可能含已失效、取用時才略過的單字)"""
+        return len(self.reviews), len(self.new)
+
+
 # =================================================================
 # MODULE 5: UI 管理層
 # =================================================================
@@ -354,6 +2615,8 @@ class UIManager:
     def render_sidebar(self):
         with st.sidebar:
             st.write(f"👤 {st.session_state.user_info.get('email', 'User')}")
+            if st.button("🚪 登出"):
+                self.app.sign_out()
             st.divider()
 
             st.subheader("🔑 API Key 設定")
@@ -371,15 +2634,98 @@ class UIManager:
                     st.rerun()
 
             st.divider()
-            st.subheader("🤖 故事風格")
-            main_theme = st.selectbox("主題", list(Config.THEME_DATA.keys()))
-            sub_theme = st.selectbox("情境", Config.THEME_DATA[main_theme])
-            st.session_state.theme_config = (main_theme, sub_theme)
+            self._render_theme_picker()
 
             st.divider()
             total = len(st.session_state.full_word_list)
-            learned = len(st.session_state.learning_data)
+            store = st.session_state.get("progress_store")
+            learned = store.learned_count if store else len(st.session_state.learning_data)
             st.caption(f"📚 總單字: {total} | 📖 已學: {learned}")
+            buffer = st.session_state.get("sync_buffer")
+            if buffer is not None and buffer.journal is not None and len(buffer):
+                st.caption(f"☁️ {len(buffer)} 筆紀錄等待同步 (已保存在本機)")
+
+            analytics = st.session_state.get("review_analytics")
+            if analytics is not None and len(analytics):
+                self._render_analytics(analytics, sharded=store is not None)
+
+            if self._is_admin():
+                self._render_profiler()
+
+    @st.fragment
+    def _render_theme_picker(self):
+        """主題選單：切換時只重跑這個區塊，故事畫面會在下次互動時讀到新的設定"""
+        st.subheader("🤖 故事風格")
+        main_theme = st.selectbox("主題", THEME_NAMES)
+        sub_theme = st.selectbox("情境", Config.THEME_DATA[main_theme])
+        st.session_state.theme_config = (main_theme, sub_theme)
+
+    @staticmethod
+    @TRACER.trace("ui.analytics")
+    def _render_analytics(analytics, sharded=False):
+        with st.expander("📊 學習分析"):
+            workload = analytics.workload()
+            retention = analytics.retention()
+            col1, col2 = st.columns(2)
+            col1.metric("今日待複習", workload["today"])
+            col2.metric("未來 7 天平均/日", f"{workload['daily_avg']:.1f}")
+            if retention["mean"] is not None:
+                st.metric("估計記憶保留率", f"{retention['mean']:.0%}",
+                          help=f"{retention['below_half']} 個單字低於 50%")
+            # 圖表第一次繪製時 Streamlit 才會載入 pandas / pyarrow (數百毫秒)，因此預設不顯示
+            if st.toggle("📈 顯示圖表", key="show_analytics_charts"):
+                st.caption(f"未來 {Config.ANALYTICS_FORECAST_DAYS} 天到期數")
+                UIManager._bar_chart("天", range(Config.ANALYTICS_FORECAST_DAYS), analytics.forecast().tolist())
+                distribution = analytics.mastery_distribution()
+                st.caption("熟練度分佈")
+                UIManager._bar_chart("熟練度", distribution.keys(), distribution.values())
+            if sharded:
+                st.caption("只包含已載入的到期分片與本次評分的單字")
+
+    @staticmethod
+    def _bar_chart(x_title, xs, ys):
+        """直接傳 Vega-Lite 規格：st.bar_chart 每次都要經過 Altair 與 DataFrame 轉換，側邊欄重跑會明顯變慢"""
+        st.vega_lite_chart({
+            "data": {"values": [{"x": x, "y": y} for x, y in zip(xs, ys)]},
+            "mark": "bar",
+            "encoding": {"x": {"field": "x", "type": "ordinal", "title": x_title},
+                         "y": {"field": "y", "type": "quantitative", "title": "單字數"}},
+            "height": 160
+        }, width="stretch")
+
+    @staticmethod
+    def _is_admin():
+        email = (st.session_state.user_info or {}).get("email")
+        admins = list(Config.ADMIN_EMAILS)
+        try:
+            admins += list(st.secrets.get("admin", {}).get("emails", []))
+        except Exception:
+            pass
+        return bool(email) and email in admins
+
+    @staticmethod
+    def _render_profiler():
+        """管理員專用：各操作延遲百分位數與快取命中率"""
+        with st.expander("⏱️ 效能監控"):
+            ops, caches = TRACER.snapshot()
+            if ops:
+                st.dataframe([{"操作": o["op"], "次數": o["count"], "錯誤": o["errors"],
+                               "p50 ms": round(o["p50_ms"], 1), "p95 ms": round(o["p95_ms"], 1),
+                               "p99 ms": round(o["p99_ms"], 1)} for o in ops],
+                             hide_index=True, use_container_width=True)
+            if caches:
+                st.dataframe([{"快取": c["cache"], "命中": c["hits"], "未命中": c["misses"],
+                               "命中率": f"{c['hit_ratio']:.0%}"} for c in caches],
+                             hide_index=True, use_container_width=True)
+            rows, totals = STARTUP.report()
+            if rows:
+                st.caption("🚀 冷啟動 (各步驟第一次執行的時間)")
+                st.dataframe([{"子系統": sub, "合計 ms": round(ms, 1),
+                               "步驟": ", ".join(f"{r['step']} {r['ms']:.0f}" for r in rows if r["subsystem"] == sub)}
+                              for sub, ms in totals.items()],
+                             hide_index=True, use_container_width=True)
+            st.download_button("Prometheus", TRACER.to_prometheus(), "metrics.prom", "text/plain")
+            st.download_button("JSON Lines", TRACER.to_json_lines(), "metrics.jsonl", "application/json")
 
     def render_main_stage(self):
         stage = st.session_state.stage
@@ -389,8 +2735,12 @@ class UIManager:
                         unsafe_allow_html=True)
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
-                if st.button("🚀 開始智慧抽詞 (5 Words)", use_container_width=True):
+                if st.button(f"🚀 開始智慧抽詞 ({Config.SESSION_SIZE} Words)", use_container_width=True):
                     self.app.start_session()
+                queue = st.session_state.daily_queue
+                if queue is not None and queue.day == DailyQueue.today():
+                    reviews, new = queue.remaining()
+                    st.caption(f"📅 今日剩餘：複習 {reviews}｜新字 {new}")
 
         elif stage == "learning":
             self._render_learning_card()
@@ -398,14 +2748,18 @@ class UIManager:
         elif stage == "story":
             self._render_story_mode()
 
+    @st.fragment
+    @TRACER.trace("ui.learning_card")
     def _render_learning_card(self):
+        """單字卡 (含評分按鈕) 為獨立 fragment：翻牌、評分只重跑這一塊，不重建側邊欄與 CSS"""
+        if st.session_state.stage != "learning":
+            st.rerun()  # 本輪最後一張的評分 callback 已換到故事頁，需要整頁重跑
         word = st.session_state.current_word
         dict_data = st.session_state.dict_info
 
-        # 進度條
-        total_session = len(st.session_state.session_queue) + (1 if word else 0)  # 簡易估算
-        # 這裡為了簡單，直接用 queue 長度反推
-        st.progress(max(0.0, min(1.0, (5 - len(st.session_state.session_queue)) / 5)))
+        # 進度條：本輪總數扣掉還在 queue 中的
+        total = len(st.session_state.session_queue_history) or 1
+        st.progress(max(0.0, min(1.0, (total - len(st.session_state.session_queue)) / total)))
 
         st.markdown(f"""
         <div class="word-card">
@@ -417,11 +2771,11 @@ class UIManager:
         if not st.session_state.show_answer:
             col_show, col_audio = st.columns([4, 1])
             with col_show:
-                if st.button("👁️ 顯示答案與意思", type="primary", use_container_width=True):
-                    st.session_state.show_answer = True
-                    st.rerun()
+                # 按鈕本身就會觸發 fragment 重跑，用 callback 改狀態即可，不需再 st.rerun()
+                st.button("👁️ 顯示答案與意思", type="primary", use_container_width=True,
+                          on_click=self._reveal_answer)
             with col_audio:
-                if st.button("🔊"): AIService.play_audio(word)
+                self._render_audio_button(word)
         else:
             AIService.play_audio(word)
             st.markdown(f"""
@@ -431,38 +2785,55 @@ class UIManager:
             </div>
             """, unsafe_allow_html=True)
 
-            if st.button("🧠 AI 幫我想個諧音/記憶法", use_container_width=True):
-                AIService.generate_mnemonic(word)
+            self._render_mnemonic(word)
 
             st.markdown("---")
             cols = st.columns(4)
             labels = [("❌ 忘記", 0), ("😓 困難", 3), ("😊 剛好", 4), ("⚡ 秒殺", 5)]
             for col, (label, score) in zip(cols, labels):
                 with col:
-                    if st.button(label, use_container_width=True):
-                        self.app.process_review(word, score)
+                    # 評分在 callback 中完成，按鈕觸發的 fragment 重跑直接顯示下一張
+                    st.button(label, use_container_width=True, on_click=self.app.process_review, args=(word, score))
 
+    @staticmethod
+    def _reveal_answer():
+        st.session_state.show_answer = True
+
+    @st.fragment
+    def _render_audio_button(self, word):
+        if st.button("🔊"): AIService.play_audio(word)
+
+    @st.fragment
+    def _render_mnemonic(self, word):
+        """記憶法按鈕與結果：只重跑這一小塊，不會重新播放語音"""
+        if st.button("🧠 AI 幫我想個諧音/記憶法", use_container_width=True):
+            AIService.generate_mnemonic(word)
+
+    @st.fragment
+    @TRACER.trace("ui.story")
     def _render_story_mode(self):
         st.markdown("<h2 style='text-align: center; color: #BB86FC;'>🎉 練習完成！</h2>", unsafe_allow_html=True)
         unknowns = st.session_state.unknown_words
         st.info(f"本次弱點單字: {', '.join(unknowns) if unknowns else '無'}")
 
-        if st.button("🪄 生成 AI 情境故事", use_container_width=True):
-            theme, sub = st.session_state.get("theme_config", ("職場生活", "辦公室趣事"))
-            target_words = unknowns if unknowns else st.session_state.session_queue_history
+        theme, sub = st.session_state.get("theme_config", ("職場生活", "辦公室趣事"))
+        target_words = unknowns if unknowns else st.session_state.session_queue_history
+        if AIService.cached_story(theme, sub, target_words) is not None:
+            AIService.generate_story(theme, sub, target_words)  # 已生成過，直接從快取顯示
+        elif st.button("🪄 生成 AI 情境故事", use_container_width=True):
             AIService.generate_story(theme, sub, target_words)
 
         if st.button("🏠 回首頁"):
             st.session_state.stage = "setup"
-            st.rerun()
+            st.rerun()  # 換頁需要整頁重跑
 
 
 # =================================================================
 # MODULE 6: 主程式 (Controller)
 # =================================================================
 class VocabularyApp:
+    @TRACER.trace("app.init")
     def __init__(self):
-        Config.load_css()
         self.fb_service = FirebaseService()
         self.ui = UIManager(self)
         self.init_state()
@@ -478,6 +2849,13 @@ class VocabularyApp:
             "unknown_words": [],
             "stage": "setup",
             "dict_info": {},
+            "prefetched_dict": {},
+            "review_index": None,
+            "review_analytics": None,
+            "batch_pipeline": None,
+            "daily_queue": None,
+            "sync_buffer": None,
+            "progress_store": None,
             "show_answer": False,
             "gemini_key": None
         }
@@ -487,7 +2865,8 @@ class VocabularyApp:
 
         # 使用快取載入單字
         if not st.session_state.full_word_list:
-            st.session_state.full_word_list = load_static_word_list(Config.FULL_WORD_FILE)
+            with STARTUP.measure("word_list", "load"):
+                st.session_state.full_word_list = load_static_word_list(Config.FULL_WORD_FILE)
 
     def handle_auth(self, email, password, is_login):
         with st.spinner("連線中..."):
@@ -495,70 +2874,210 @@ class VocabularyApp:
             if "error" in res:
                 st.error(f"❌ {res['error']['message']}")
             else:
-                uid = res["localId"]
-                st.session_state.user_info = {"email": res["email"], "uid": uid, "token": res["idToken"]}
-
-                # 載入用戶資料
-                data, key = self.fb_service.load_user_data(uid)
-                st.session_state.learning_data = data or {}
-                if key: st.session_state.gemini_key = key
+                # 網址記下 session id，重新整理頁面時可直接還原登入
+                st.query_params["sid"] = get_auth_sessions().create(res)
+                self.sign_in(res["localId"], res["email"], res["idToken"])
                 st.rerun()
 
+    def restore_session(self):
+        """網址帶有有效的 sid 時還原登入 (不必重新輸入密碼)，成功回傳 True"""
+        sid = st.query_params.get("sid")
+        if not sid:
+            return False
+        with st.spinner("還原登入狀態..."):
+            restored = get_auth_sessions().restore(sid, self.fb_service.refresh_token)
+            if restored is None:
+                del st.query_params["sid"]
+                return False
+            st.query_params["sid"], entry = restored  # sid 單次使用：換上新發的
+            self.sign_in(entry["uid"], entry["email"], entry["id_token"])
+        return True
+
+    def sign_in(self, uid, email, token):
+        st.session_state.user_info = {"email": email, "uid": uid, "token": token}
+
+        # 載入用戶資料 (已搬到分片的使用者只載入到期的部分，不論目前的 SHARDED_STORAGE 設定)
+        store = None
+        data, key, saved_queue = {}, None, None
+        if self.fb_service.db:
+            store = ShardedProgress(self.fb_service.db, uid)
+            data, key, saved_queue = store.load(migrate=Config.SHARDED_STORAGE)
+            if not store.sharded:
+                store = None
+        data = data or {}
+        # 本地日誌中尚未同步、且比雲端新的評分 (雲端已有更新版本的紀錄會從日誌移除)
+        journal = get_review_journal(uid) if Config.LOCAL_JOURNAL else None
+        if journal is not None:
+            data.update(journal.reconcile(data))
+        if Config.COMPACT_LEARNING_DATA:
+            data = CompactLearningStore.from_dict(data, st.session_state.full_word_list)
+        st.session_state.learning_data = data
+        st.session_state.review_index = ReviewIndex(st.session_state.learning_data,
+                                                    st.session_state.full_word_list)
+        st.session_state.review_analytics = ReviewAnalytics(st.session_state.learning_data)
+        st.session_state.progress_store = store
+        st.session_state.daily_queue = DailyQueue.from_dict(
+            saved_queue, is_seen=store.is_seen if store else None) if saved_queue else None
+        writer = store.save_changes if store else self.fb_service.save_changes
+        buffer = st.session_state.sync_buffer = SyncBuffer(writer, uid, journal=journal)
+        if len(buffer): buffer.flush_in_background()
+        if key: st.session_state.gemini_key = key
+
+    def sign_out(self):
+        self.flush_sync()
+        sid = st.query_params.get("sid")
+        if sid:
+            get_auth_sessions().discard(sid)
+        st.query_params.clear()
+        st.session_state.clear()
+        st.rerun()
+
     def start_session(self):
         if not st.session_state.full_word_list:
             st.error("單字庫未載入 (full-word.json)")
             return
 
-        selected = SRSEngine.get_review_batch(st.session_state.learning_data, st.session_state.full_word_list)
+        if st.session_state.review_index is None:
+            st.session_state.review_index = ReviewIndex(st.session_state.learning_data,
+                                                        st.session_state.full_word_list)
+        if st.session_state.batch_pipeline is None:
+            st.session_state.batch_pipeline = BatchPipeline()
+
+        # 從今天的佇列切出一批；上一輪已在背景準備好時 (字典與語音多半已在快取中) 記為命中
+        queue = self.daily_queue()
+        index = st.session_state.review_index
+        TRACER.record_cache("next_batch", st.session_state.batch_pipeline.take(queue, index))
+        selected = queue.take(index)
         if not selected:
-            st.warning("沒有單字可供學習")
+            st.success("🎉 今天的單字都學完了，明天再來吧！")
             return
+        self.save_daily_queue()
+        random.shuffle(selected)
 
         st.session_state.session_queue = selected
         st.session_state.session_queue_history = selected.copy()
         st.session_state.unknown_words = []
+
+        # 在顯示第一張卡片前先並行取得整批字典資料
+        AIService.prefetch_audio(selected)
+        with st.spinner("載入中..."):
+            AIService.prefetch_dictionary(selected)
+        self.stage_next_batch()
         self.next_card()
 
-    def next_card(self):
+    def daily_queue(self):
+        """今天的學習佇列；還沒有或已經跨日時重新建立 (每位使用者每天一次)"""
+        queue = st.session_state.daily_queue
+        if queue is None or queue.day != DailyQueue.today():
+            store = st.session_state.progress_store
+            queue = st.session_state.daily_queue = DailyQueue.build(
+                st.session_state.review_index, is_seen=store.is_seen if store else None)
+        return queue
+
+    def save_daily_queue(self):
+        """在背景寫回使用者文件 (失敗無妨：已取用的單字下次取用時會被判定失效而略過)"""
+        uid = st.session_state.user_info["uid"]
+        get_daily_queue_writer().submit(uid, self.fb_service.save_daily_queue, uid,
+                                        st.session_state.daily_queue.to_dict())
+
+    def stage_next_batch(self):
+        """趁本輪學習時準備佇列的下一段"""
+        if not Config.PIPELINE_NEXT_BATCH:
+            return
+        st.session_state.batch_pipeline.stage(st.session_state.daily_queue, st.session_state.review_index,
+                                              api_key=st.session_state.gemini_key)
+
+    def next_card(self, rerun=True):
+        """換到下一張 (或本輪結束時換到故事頁)；在 callback 中呼叫時傳 rerun=False，由按鈕本身觸發重跑"""
         st.session_state.show_answer = False
         if st.session_state.session_queue:
             word = st.session_state.session_queue.pop(0)
             st.session_state.current_word = word
 
-            # 這裡呼叫 Service，Service 會呼叫 Cached Function，速度極快
-            with st.spinner("載入中..."):
-                st.session_state.dict_info = AIService.fetch_dictionary(word)
+            # 優先使用預先查好的結果；預取失敗的單字才個別查詢
+            prefetched = st.session_state.prefetched_dict.pop(word, None)
+            if prefetched:
+                st.session_state.dict_info = prefetched
+            else:
+                with st.spinner("載入中..."):
+                    st.session_state.dict_info = AIService.fetch_dictionary(word)
 
             st.session_state.stage = "learning"
         else:
             st.session_state.stage = "story"
-        st.rerun()
+            self.flush_sync()  # Session 結束時寫入雲端
+            if st.session_state.daily_queue is not None:
+                self.save_daily_queue()  # 本輪答錯重排的單字
+
+        if rerun:
+            st.rerun()
 
     def process_review(self, word, score):
+        """評分按鈕的 callback (在重跑前執行)"""
         # 1. 更新資料
         current_data = st.session_state.learning_data.get(word, {})
-        new_data = SRSEngine.calculate_next_review(current_data, score)
+        new_data = SRSEngine.calculate_next_review(current_data, score, word=word,
+                                                   index=st.session_state.review_index)
         st.session_state.learning_data[word] = new_data
+        analytics = st.session_state.review_analytics
+        if analytics is not None: analytics.update(word, new_data)
+        # 答錯的字今天再複習一次；佇列前端因此改變時重新準備下一批
+        queue = st.session_state.daily_queue
+        if queue is not None:
+            if score == 0: queue.requeue(word)
+            pipeline = st.session_state.batch_pipeline
+            if pipeline is not None and not pipeline.on_review(queue, st.session_state.review_index):
+                self.stage_next_batch()
 
         # 2. 紀錄弱點
         if score == 0 and word not in st.session_state.unknown_words:
             st.session_state.unknown_words.append(word)
 
-        # 3. 雲端同步 (若擔心頻繁寫入，也可改為結束 Session 才存)
-        if st.session_state.user_info:
-            self.fb_service.save_data(st.session_state.user_info['uid'], st.session_state.learning_data)
+        # 3. 雲端同步：先寫入本地日誌並標記變動，由緩衝區依時間/數量在背景批次寫入
+        buffer = st.session_state.sync_buffer
+        if buffer is not None:
+            buffer.mark_dirty(word, new_data)
+            buffer.maybe_flush(background=buffer.journal is not None)
 
-        # 4. 下一張
-        self.next_card()
+        # 4. 下一張 (按鈕觸發的 fragment 重跑會顯示新的單字卡)
+        self.next_card(rerun=False)
+
+    def flush_sync(self):
+        buffer = st.session_state.sync_buffer
+        if buffer is None: return
+        if buffer.journal is not None:
+            buffer.flush_in_background()  # 已寫入本地日誌，不必等待雲端
+        elif not buffer.flush():
+            st.toast("⚠️ 雲端同步失敗，稍後會自動重試")
 
+    @TRACER.trace("app.run")
     def run(self):
-        if not st.session_state.user_info:
+        Config.load_css()
+        if not st.session_state.user_info and not self.restore_session():
             self.ui.render_login()
         else:
+            # 定時寫入：即使沒有評分動作，超過時間也會在重繪時同步
+            buffer = st.session_state.sync_buffer
+            if buffer is not None: buffer.maybe_flush(background=buffer.journal is not None)
             self.ui.render_sidebar()
             self.ui.render_main_stage()
 
 
-if __name__ == "__main__":
-    app = VocabularyApp()
+def main():
+    # 控制器只在 session 第一次執行時建立，之後的重跑直接沿用
+    app = st.session_state.get("_app")
+    if app is None:
+        with STARTUP.measure("app", "controller"):
+            app = st.session_state._app = VocabularyApp()
     app.run()
+    # 畫面已送出 (st.rerun 會在上一行中斷，不會走到這裡)
+    if Config.WARM_UP_IMPORTS:
+        warm_up_in_background()
+
+
+if ("app", "import") not in STARTUP:
+    STARTUP.record("app", "import", time.perf_counter() - _IMPORT_STARTED)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""離線預先計算工具 (與 Streamlit UI 分離)
+
+用法：
+    python precompute.py dictionary --api-key KEY [--workers 4] [--rate 2]
+    python precompute.py audio [--workers 4] [--rate 5]
+
+dictionary: 走訪 Config.FULL_WORD_FILE 的所有單字，以 Config.PROMPTS["dictionary"] 產生字典資料，
+寫入 Config.DICT_PACK_FILE 供 App 直接讀取。進度會持續寫入 checkpoint 檔，
+中斷後重新執行同一指令即可從上次進度繼續。
+
+audio: 預先合成所有單字的語音到 Config.AUDIO_CACHE_DIR (已存在的會略過，可隨時中斷重跑)。
+預設不套用 App 的 AUDIO_CACHE_MAX_BYTES (否則大型單字表會淘汰自己剛合成的檔案)，可用 --max-mb 另設上限；
+App 執行時仍會依 AUDIO_CACHE_MAX_BYTES 淘汰，部署時請把它調到足以容納預先合成的結果。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from online_vocab_app import (
+    Config, AudioCache, DictionaryCache, DictionaryPack, KeyRateLimiter, TokenBucket,
+    load_static_word_list, _request_ai_definition
+)
+
+
+class ProgressReporter:
+    """定期輸出進度、吞吐量與預估剩餘時間"""
+
+    def __init__(self, total, done=0, interval=5.0, stream=sys.stderr):
+        self.total = total
+        self.done = done
+        self.failed = 0
+        self.interval = interval
+        self.stream = stream
+        self._start_done = done
+        self._started = time.monotonic()
+        self._last_report = 0.0
+
+    def update(self, ok=True):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def throughput(self):
+        elapsed = time.monotonic() - self._started
+        return (self.done - self._start_done) / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        rate = self.throughput()
+        remaining = self.total - self.done
+        eta = remaining / rate if rate > 0 else float("inf")
+        pct = 100.0 * self.done / self.total if self.total else 100.0
+        print(f"[{self.done}/{self.total} {pct:5.1f}%] {rate:6.2f} words/s | "
+              f"失敗 {self.failed} | 預估剩餘 {eta:,.0f}s", file=self.stream)
+
+    def summary(self):
+        elapsed = time.monotonic() - self._started
+        return {
+            "total": self.total,
+            "done": self.done,
+            "processed_this_run": self.done - self._start_done,
+            "failed": self.failed,
+            "elapsed_sec": round(elapsed, 2),
+            "words_per_sec": round(self.throughput(), 3)
+        }
+
+
+def load_checkpoint(path):
+    """讀取已完成的單字 (JSON Lines，每行 {"word", "entry"})；忽略中斷時寫壞的最後一行"""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[record["word"]] = record["entry"]
+    return entries
+
+
+def precompute_dictionary(args):
+    words = list(dict.fromkeys(load_static_word_list(args.word_file)))
+    if args.limit:
+        words = words[:args.limit]
+    if not words:
+        print(f"找不到單字 ({args.word_file})", file=sys.stderr)
+        return 1
+
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    entries = load_checkpoint(checkpoint_path)
+    pending = [w for w in words if w not in entries]
+    print(f"共 {len(words)} 個單字，已完成 {len(words) - len(pending)}，待處理 {len(pending)}",
+          file=sys.stderr)
+
+    # 自己的每 Key token bucket 交給 call_gemini，不改動 App 共用限流器的 Config 設定
+    limiter = KeyRateLimiter(args.rate if args.rate > 0 else 1e9, args.workers)
+    progress = ProgressReporter(len(words), done=len(words) - len(pending), interval=args.report_every)
+
+    def task(word):
+        return _request_ai_definition(word, args.api_key, limiter)
+
+    interrupted = False
+    with open(checkpoint_path, "a", encoding="utf-8") as ckpt, \
+            ThreadPoolExecutor(max_workers=args.workers) as pool:
+        queue = iter(pending)
+        in_flight = {}
+        try:
+            # 只保留有限數量的工作在佇列中，避免一次建立數十萬個 Future
+            while True:
+                while len(in_flight) < args.workers * 2:
+                    word = next(queue, None)
+                    if word is None: break
+                    in_flight[pool.submit(task, word)] = word
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    word = in_flight.pop(future)
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        print(f"✗ {word}: {e}", file=sys.stderr)
+                        progress.update(ok=False)
+                        continue
+                    entries[word] = entry
+                    ckpt.write(json.dumps({"word": word, "entry": entry}, ensure_ascii=False) + "\n")
+                    ckpt.flush()
+                    progress.update()
+        except KeyboardInterrupt:
+            interrupted = True
+            for future in in_flight:
+                future.cancel()
+            print("已中斷，進度已保存於 checkpoint，重新執行即可繼續", file=sys.stderr)
+
+    progress.report()
+    if not interrupted:
+        prompt_hash = DictionaryCache.prompt_hash(Config.PROMPTS["dictionary"])
+        DictionaryPack.write(args.output, {w: entries[w] for w in words if w in entries},
+                             Config.MODEL_NAME, prompt_hash)
+        print(f"已寫入 {args.output}", file=sys.stderr)
+    print(json.dumps(progress.summary(), ensure_ascii=False))
+    return 130 if interrupted else 0
+
+
+def precompute_audio(args):
+    words = list(dict.fromkeys(load_static_word_list(args.word_file)))
+    if args.limit:
+        words = words[:args.limit]
+    limiter = TokenBucket(args.rate, capacity=args.workers) if args.rate > 0 else None
+
+    class RateLimitedCache(AudioCache):
+        def synthesize(self, text, lang="en"):
+            if limiter is not None:
+                limiter.acquire()
+            return AudioCache.synthesize(text, lang)
+
+    cache = RateLimitedCache(args.cache_dir, args.max_mb * 1024 * 1024 if args.max_mb > 0 else None)
+    pending = [w for w in words if not cache.has(w)]
+    print(f"共 {len(words)} 個單字，待合成 {len(pending)}", file=sys.stderr)
+    progress = ProgressReporter(len(words), done=len(words) - len(pending), interval=args.report_every)
+    try:
+        cache.warm(pending, workers=args.workers, on_done=progress.update)
+    except KeyboardInterrupt:
+        print("已中斷，已合成的語音都已保存，重新執行即可繼續", file=sys.stderr)
+        return 130
+    progress.report()
+    print(json.dumps(progress.summary(), ensure_ascii=False))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線預先計算工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_dict = sub.add_parser("dictionary", help="產生預先計算的字典檔")
+    p_dict.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"))
+    p_dict.add_argument("--word-file", default=Config.FULL_WORD_FILE)
+    p_dict.add_argument("--output", default=Config.DICT_PACK_FILE)
+    p_dict.add_argument("--checkpoint", default=None, help="預設為 <output>.checkpoint")
+    p_dict.add_argument("--workers", type=int, default=4)
+    p_dict.add_argument("--rate", type=float, default=2.0, help="每秒最多請求數 (0 = 不限)")
+    p_dict.add_argument("--limit", type=int, default=0, help="只處理前 N 個單字 (測試用)")
+    p_dict.add_argument("--report-every", type=float, default=5.0, help="進度輸出間隔 (秒)")
+
+    p_audio = sub.add_parser("audio", help="預先合成所有單字的語音")
+    p_audio.add_argument("--word-file", default=Config.FULL_WORD_FILE)
+    p_audio.add_argument("--cache-dir", default=Config.AUDIO_CACHE_DIR)
+    p_audio.add_argument("--workers", type=int, default=Config.AUDIO_WORKERS)
+    p_audio.add_argument("--rate", type=float, default=5.0, help="每秒最多請求數 (0 = 不限)")
+    p_audio.add_argument("--limit", type=int, default=0)
+    p_audio.add_argument("--max-mb", type=float, default=0, help="快取目錄大小上限 (MB，0 = 不限)")
+    p_audio.add_argument("--report-every", type=float, default=5.0)
+
+    args = parser.parse_args(argv)
+    if args.command == "audio":
+        return precompute_audio(args)
+    if args.command == "dictionary":
+        if not args.api_key:
+            parser.error("需要 --api-key 或環境變數 GEMINI_API_KEY")
+        return precompute_dictionary(args)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
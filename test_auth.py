@@ -0,0 +1,86 @@
+"""AuthSessionStore 的回歸測試 (以 benchmarks.py 的 FakeAuthEmulator 替身執行)
+
+用法：
+    python -m pytest -q test_auth.py
+"""
+import time
+
+import pytest
+
+from benchmarks import FakeAuthEmulator, FakeFirestore, install_secrets
+import online_vocab_app
+from online_vocab_app import AuthSessionStore, Config, FirebaseService
+
+
+@pytest.fixture
+def emulator(monkeypatch):
+    emulator = FakeAuthEmulator()
+    monkeypatch.setenv("FIREBASE_AUTH_EMULATOR_HOST", emulator.start())
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def service(emulator):
+    install_secrets()
+    return FirebaseService(db=FakeFirestore())
+
+
+@pytest.fixture
+def store():
+    return AuthSessionStore(max_sessions=8, ttl=60)
+
+
+def signed_up(service, expires_in=None):
+    res = service.auth_user("a@example.com", "password", is_login=False)
+    assert "error" not in res
+    if expires_in is not None:
+        res["expiresIn"] = str(expires_in)
+    return res
+
+
+def no_refresh(token):
+    raise AssertionError("ID token 還沒到期，不應該呼叫 refresh")
+
+
+def test_restore_rotates_sid(service, store):
+    res = signed_up(service)
+    sid = store.create(res)
+
+    new_sid, entry = store.restore(sid, no_refresh)
+    assert new_sid != sid
+    assert entry["uid"] == res["localId"] and entry["id_token"] == res["idToken"]
+    assert store.restore(sid, no_refresh) is None  # 舊 sid 只能用一次
+    assert store.restore(new_sid, no_refresh) is not None
+    assert len(store) == 1
+
+
+def test_idle_session_expires(service, store, monkeypatch):
+    sid = store.create(signed_up(service))
+    now = time.time()
+    monkeypatch.setattr(online_vocab_app.time, "time", lambda: now + store.ttl + 1)
+    assert store.restore(sid, no_refresh) is None
+    assert len(store) == 0  # 過期的 sid 也一併作廢
+
+
+def test_token_near_expiry_is_refreshed(service, store, emulator):
+    res = signed_up(service, expires_in=Config.TOKEN_REFRESH_MARGIN - 1)
+    sid = store.create(res)
+
+    new_sid, entry = store.restore(sid, service.refresh_token)
+    assert entry["id_token"] != res["idToken"]
+    assert entry["refresh_token"] != res["refreshToken"]
+    assert entry["expires_at"] - time.time() > Config.TOKEN_REFRESH_MARGIN
+    assert emulator.requests == 2  # signUp + token
+    assert store.restore(new_sid, no_refresh) is not None
+
+
+def test_failed_refresh_drops_session(service, store, emulator):
+    res = signed_up(service, expires_in=0)
+    sid = store.create(res)
+    with emulator._lock:
+        emulator._refresh.clear()  # refresh token 已被撤銷
+
+    assert store.restore(sid, service.refresh_token) is None
+    assert len(store) == 0
+    assert store.restore(sid, service.refresh_token) is None
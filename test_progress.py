@@ -0,0 +1,78 @@
+"""ShardedProgress 與 DailyQueue 的回歸測試 (以 benchmarks.py 的 FakeFirestore 替身執行)
+
+用法：
+    python -m pytest -q test_progress.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks import FakeFirestore
+from online_vocab_app import DailyQueue, ReviewIndex, ShardedProgress
+
+
+def day(offset):
+    return (datetime.now() + timedelta(days=offset)).date().isoformat()
+
+
+def entry(seen, offset):
+    return {"seen": seen, "next_review": day(offset) + "T09:00:00"}
+
+
+def shards_with(db, word, uid="u1"):
+    prefix = f"users/{uid}/progress/"
+    return sorted(path[len(prefix):] for path, doc in db.docs.items()
+                  if path.startswith(prefix) and word in doc.get("words", {}))
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore()
+    db.docs["users/u1"] = {"storage": ShardedProgress.VERSION, "learned_count": 1}
+    return db
+
+
+def put_shard(db, offset, words):
+    db.docs[f"users/u1/progress/{day(offset)}"] = {"day": day(offset), "words": words}
+
+
+def test_review_of_unloaded_word_moves_it_out_of_old_shard(db):
+    """別的裝置學過、分片沒有載入的單字，重新評分後不能同時留在新舊兩個分片"""
+    put_shard(db, 30, {"a": entry(1, 30)})
+    db.docs[f"users/u1/seen/{ShardedProgress.seen_bucket('a')}"] = {"words": ["a"]}
+    store = ShardedProgress(db, "u1")
+    data, _, _ = store.load()
+    assert data == {}
+
+    store.save_changes("u1", {"a": entry(2, 0)})
+    assert shards_with(db, "a") == [day(0)]
+    assert db.docs["users/u1"]["learned_count"] == 1
+
+
+def test_load_keeps_higher_seen_and_next_save_drops_duplicate(db):
+    put_shard(db, -1, {"a": entry(3, -1)})
+    put_shard(db, 0, {"a": entry(1, 0)})
+    store = ShardedProgress(db, "u1")
+    data, _, _ = store.load()
+    assert data["a"]["seen"] == 3
+
+    store.save_changes("u1", {"a": entry(4, 1)})
+    assert shards_with(db, "a") == [day(1)]
+    assert db.docs["users/u1"]["learned_count"] == 1
+
+
+def test_new_word_is_counted_once(db):
+    store = ShardedProgress(db, "u1")
+    store.load()
+    store.save_changes("u1", {"b": entry(1, 1)})
+    store.save_changes("u1", {"b": entry(2, 3)})
+    assert shards_with(db, "b") == [day(3)]
+    assert db.docs["users/u1"]["learned_count"] == 2
+
+
+def test_daily_queue_skips_new_words_seen_in_unloaded_shards():
+    index = ReviewIndex({}, ["a", "b", "c"])
+    queue = DailyQueue(DailyQueue.today(), [], ["a", "b", "c"], is_seen=lambda word: word == "a")
+    assert queue.peek(index, size=2) == ["b", "c"]
+    assert queue.take(index, size=2) == ["b", "c"]
+    assert queue.new == []
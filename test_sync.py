@@ -0,0 +1,175 @@
+"""SyncBuffer、ReviewJournal 與 CoalescingWriter 的回歸測試 (以 benchmarks.py 的 FakeFirestore 替身執行)
+
+用法：
+    python -m pytest -q test_sync.py
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks import FakeFirestore, install_secrets
+from online_vocab_app import CoalescingWriter, Config, FirebaseService, ReviewJournal, SyncBuffer
+
+
+def cloud_words(db, uid="u1"):
+    return db.docs.get(f"users/{uid}", {}).get("learning_data", {})
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return ReviewJournal("u1", directory=str(tmp_path), fsync=False)
+
+
+@pytest.fixture
+def service():
+    install_secrets()
+    return FirebaseService(db=FakeFirestore())
+
+
+def test_concurrent_flushes_keep_newest_grade(service, journal):
+    """較慢的舊 flush 不能在較新的 flush 之後才寫入 (否則雲端留下舊評分、日誌又已 ack)"""
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def writer(uid, changes):
+        calls.append(dict(changes))
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+        service.save_changes(uid, changes)
+
+    buffer = SyncBuffer(writer, "u1", flush_interval=0, journal=journal)
+    buffer.mark_dirty("a", {"seen": 1})
+    slow = buffer.flush_in_background()
+    assert started.wait(5)
+    buffer.mark_dirty("a", {"seen": 2})
+    fast = threading.Thread(target=buffer.flush)
+    fast.start()
+    time.sleep(0.1)
+    assert len(calls) == 1  # 第二個 flush 等第一個寫完才開始
+    release.set()
+    slow.join(5)
+    fast.join(5)
+
+    assert cloud_words(service.db) == {"a": {"seen": 2}}
+    assert journal.pending() == {}
+    assert len(buffer) == 0
+
+
+def test_timer_flush_waits_for_running_flush(service, journal):
+    started, release = threading.Event(), threading.Event()
+
+    def writer(uid, changes):
+        if changes["a"]["seen"] == 1:
+            started.set()
+            release.wait(5)
+        service.save_changes(uid, changes)
+
+    buffer = SyncBuffer(writer, "u1", flush_interval=0.05, journal=journal)
+    buffer.mark_dirty("a", {"seen": 1})
+    slow = buffer.flush_in_background()
+    assert started.wait(5)
+    buffer.mark_dirty("a", {"seen": 2})
+    time.sleep(0.2)  # 計時器已觸發，正在等待
+    release.set()
+    slow.join(5)
+    deadline = time.monotonic() + 5
+    while journal.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert cloud_words(service.db) == {"a": {"seen": 2}}
+    assert journal.pending() == {}
+
+
+def test_failed_flush_keeps_newer_grade(journal):
+    def failing(uid, changes):
+        raise RuntimeError("offline")
+
+    buffer = SyncBuffer(failing, "u1", flush_interval=0, journal=journal)
+    buffer.mark_dirty("a", {"seen": 1})
+    assert buffer.flush() is False
+    buffer.mark_dirty("a", {"seen": 2})
+    assert buffer._dirty == {"a": {"seen": 2}}
+    assert journal.pending() == {"a": {"seen": 2}}
+
+
+def test_pending_grades_survive_restart(service, tmp_path, journal):
+    journal.append("a", {"seen": 1})
+    journal.append("b", {"seen": 1})
+    journal.ack(1, ["a"])
+
+    reopened = ReviewJournal("u1", directory=str(tmp_path), fsync=False)
+    assert reopened.pending() == {"b": {"seen": 1}}
+    buffer = SyncBuffer(service.save_changes, "u1", flush_interval=0, journal=reopened)
+    assert buffer.flush() is True
+    assert cloud_words(service.db) == {"b": {"seen": 1}}
+    assert ReviewJournal("u1", directory=str(tmp_path), fsync=False).pending() == {}
+
+
+def test_ack_keeps_words_graded_after_the_flush(journal):
+    journal.append("a", {"seen": 1})
+    seq = journal.seq
+    journal.append("a", {"seen": 2})
+    journal.ack(seq, ["a"])
+    assert journal.pending() == {"a": {"seen": 2}}
+
+
+def test_compaction_truncates_log_and_keeps_pending(monkeypatch, tmp_path, journal):
+    monkeypatch.setattr(Config, "JOURNAL_COMPACT_EVERY", 4)
+    for i in range(3):
+        journal.append(f"w{i}", {"seen": 1})
+    journal.ack(2, ["w0", "w1"])
+
+    assert os.path.getsize(journal.log_path) == 0
+    with open(journal.snapshot_path, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    assert snapshot["seq"] == 3
+    assert set(snapshot["pending"]) == {"w2"}
+    reopened = ReviewJournal("u1", directory=str(tmp_path), fsync=False)
+    assert reopened.pending() == {"w2": {"seen": 1}}
+    assert reopened.append("w3", {"seen": 1}) == 4
+
+
+def test_replay_skips_torn_last_line(tmp_path, journal):
+    journal.append("a", {"seen": 1})
+    with open(journal.log_path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "word": "b", "da')
+    reopened = ReviewJournal("u1", directory=str(tmp_path), fsync=False)
+    assert reopened.pending() == {"a": {"seen": 1}}
+
+
+def test_reconcile_drops_entries_the_cloud_already_has(journal):
+    journal.append("a", {"seen": 1})
+    journal.append("b", {"seen": 3})
+    fresh = journal.reconcile({"a": {"seen": 2}, "b": {"seen": 2}})
+    assert fresh == {"b": {"seen": 3}}
+    assert journal.pending() == {"b": {"seen": 3}}
+
+
+def test_coalescing_writer_keeps_only_latest_per_key():
+    started, release = threading.Event(), threading.Event()
+    written = []
+
+    def write(uid, queue):
+        if queue == 0:
+            started.set()
+            release.wait(5)
+        written.append((uid, queue))
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        writer = CoalescingWriter(pool)
+        writer.submit("u1", write, "u1", 0)
+        assert started.wait(5)
+        for queue in (1, 2, 3):
+            writer.submit("u1", write, "u1", queue)
+        writer.submit("u2", write, "u2", 1)  # 另一位使用者不必等 u1 寫完
+        deadline = time.monotonic() + 5
+        while ("u2", 1) not in written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert written == [("u2", 1)]
+        release.set()
+    assert written == [("u2", 1), ("u1", 0), ("u1", 3)]
@@ -0,0 +1,63 @@
+"""單字檔串流解析與 .idx 索引的回歸測試
+
+用法：
+    python -m pytest -q test_word_list.py
+"""
+import io
+import json
+
+import pytest
+
+from online_vocab_app import WordListIndex, _load_word_list, iter_json_array, load_static_word_list
+
+ITEMS = [{"word": "apple", "score": 12.5}, 12.5, -3e10, "naïve", {"value": {"word": "b"}}, [1, 2], None, True]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7])
+def test_tiny_chunks_parse_like_json_load(chunk_size):
+    text = json.dumps(ITEMS, ensure_ascii=False, indent=1)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == ITEMS
+
+
+def test_number_at_end_of_chunk_is_not_cut():
+    # "12." 在第一個 chunk 的結尾，後面的 "5" 在下一個 chunk
+    assert list(iter_json_array(io.StringIO("[12.5, 7]"), chunk_size=4)) == [12.5, 7]
+
+
+@pytest.mark.parametrize("text", ["", "   ", "[]", "[ ]"])
+def test_empty_input(text):
+    assert list(iter_json_array(io.StringIO(text), chunk_size=2)) == []
+
+
+def test_top_level_must_be_array():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"word": "a"}'), chunk_size=2))
+
+
+@pytest.fixture
+def word_file(tmp_path):
+    path = tmp_path / "full-word.json"
+    path.write_text(json.dumps([{"word": w} for w in ["apple", "banana", "cherry"]]), encoding="utf-8")
+    _load_word_list.clear()
+    yield str(path)
+    _load_word_list.clear()
+
+
+def test_index_round_trip(word_file):
+    assert list(load_static_word_list(word_file)) == ["apple", "banana", "cherry"]
+    assert WordListIndex.read(word_file) == ["apple", "banana", "cherry"]
+
+
+@pytest.mark.parametrize("keep", [4, 12, 28, -3])
+def test_truncated_index_is_rebuilt(word_file, keep):
+    load_static_word_list(word_file)
+    path = WordListIndex.path_for(word_file)
+    with open(path, "rb") as f:
+        blob = f.read()
+    with open(path, "wb") as f:
+        f.write(blob[:keep])
+    assert WordListIndex.read(word_file) is None
+
+    _load_word_list.clear()
+    assert list(load_static_word_list(word_file)) == ["apple", "banana", "cherry"]
+    assert WordListIndex.read(word_file) == ["apple", "banana", "cherry"]